@@ -0,0 +1,107 @@
+import time
+import asyncio
+import threading
+import multiprocessing
+import concurrent.futures
+from model import parse_puzzle, solve_puzzle, SolveResult
+
+#the solver keeps global state (Variable.undoDict, the bt_search
+#statistics, the warm models), so a process runs one search at a time
+_lock = threading.Lock()
+_executor = None
+_manager = None
+#the search stops this long before solve's deadline, so that it normally
+#hands back its own result (and the solutions found so far) in time
+_margin = 0.05
+
+
+class PolledEvent:
+    '''Wrap an event that is slow to query (a multiprocessing.Manager
+       Event, each is_set() is a round trip to the manager process) so
+       that is_set() only queries it every interval seconds. The search
+       checks its cancel event at every node.'''
+    def __init__(self, event, interval=0.05):
+        self.event = event
+        self.interval = interval
+        self._polled = 0.0
+        self._set = False
+
+    def set(self):
+        self.event.set()
+
+    def is_set(self):
+        if not self._set and time.time() - self._polled >= self.interval:
+            self._polled = time.time()
+            self._set = self.event.is_set()
+        return self._set
+
+
+def default_executor():
+    '''the process pool used when solve is given no executor, created on
+       first use with one worker per CPU'''
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ProcessPoolExecutor()
+    return _executor
+
+def shutdown():
+    '''stop the default executor and the manager of the cancel events'''
+    global _executor, _manager
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+
+def _cancel_event(executor):
+    '''an event the search in executor can see being set'''
+    global _manager
+    if isinstance(executor, concurrent.futures.ThreadPoolExecutor):
+        return threading.Event()
+    if _manager is None:
+        _manager = multiprocessing.Manager()
+    return PolledEvent(_manager.Event())
+
+def _run(puzzle, options, cancel, deadline):
+    with _lock:
+        #the time spent queued counts against the deadline
+        if deadline is not None:
+            options = dict(options, timeLimit=max(0.0, deadline - _margin - time.time()))
+        return solve_puzzle(puzzle, cancel=cancel, **options)
+
+
+async def solve(puzzle, *, timeout=None, executor=None, **options):
+    '''Solve puzzle (a Puzzle or its text in the input file format)
+       without blocking the event loop: the search runs in executor, a
+       concurrent.futures process or thread pool (default_executor() if
+       None). Searches in one process run one at a time, as the solver
+       keeps global state; use a process pool to run them in parallel.
+
+       timeout bounds the whole call in seconds, from the call on
+       (waiting for the executor and for the other searches of its
+       process included): past it the search is cancelled and a
+       'timeout' SolveResult with no solutions is returned if the search
+       has not returned one of its own. options are the other
+       keyword arguments of BattleshipModel.solve (algo='SAT',
+       solutionLimit=2, ...). Cancelling the awaiting task stops the
+       search. Returns a SolveResult (status 'solved', 'unsat',
+       'timeout' or 'cancelled', the solutions as lists of rows and the
+       statistics), raises ValueError if the text is malformed.'''
+    if isinstance(puzzle, str):
+        puzzle = parse_puzzle(puzzle)
+    if executor is None:
+        executor = default_executor()
+    t_start = time.time()
+    deadline = t_start + timeout if timeout is not None else None
+    cancel = _cancel_event(executor)
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, _run, puzzle, options, cancel, deadline)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        cancel.set()
+        return SolveResult('timeout', [], 0, 0, time.time() - t_start, 0)
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
@@ -1,6 +1,8 @@
 from csp import Constraint, Variable, CSP
 from constraints import *
+from searchtrace import TraceWriter
 import random
+import time
 
 class UnassignedVars:
     '''class for holding the unassigned variables of a CSP. We can extract
@@ -8,29 +10,57 @@ class UnassignedVars:
        initialized by passing a select_criteria (to determine the
        order variables are extracted) and the CSP object.
 
-       select_criteria = ['random', 'fixed', 'mrv'] with
+       select_criteria = ['random', 'fixed', 'mrv', 'domwdeg'] with
        'random' == select a random unassigned variable
        'fixed'  == follow the ordering of the CSP variables (i.e.,
                    csp.variables()[0] before csp.variables()[1]
        'mrv'    == select the variable with minimum values in its current domain
                    break ties by the ordering in the CSP variables.
+       'domwdeg'== select the variable with the smallest current domain size
+                   divided by the sum of the weights of its constraints.
+                   A constraint's weight (1 to start with) is bumped by
+                   conflict() every time it wipes out a domain.
+
+       If a random.Random rng is passed, it is used for 'random' and to
+       break 'mrv'/'domwdeg' ties at random. weights is the dict of
+       constraint weights, pass the same dict again to carry the weights
+       over to a new search (e.g. after a restart).
     '''
-    def __init__(self, select_criteria, csp):
-        if select_criteria not in ['random', 'fixed', 'mrv']:
+    def __init__(self, select_criteria, csp, rng=None, weights=None):
+        if select_criteria not in ['random', 'fixed', 'mrv', 'domwdeg']:
             pass #print "Error UnassignedVars given an illegal selection criteria {}. Must be one of 'random', 'stack', 'queue', or 'mrv'".format(select_criteria)
         self.unassigned = list(csp.variables())
         self.csp = csp
         self._select = select_criteria
+        self._rng = rng
+        self.weights = weights if weights is not None else dict()
         if select_criteria == 'fixed':
             #reverse unassigned list so that we can add and extract from the back
             self.unassigned.reverse()
 
+    def conflict(self, cnstr):
+        '''record that cnstr wiped out a domain'''
+        self.weights[cnstr] = self.weights.get(cnstr, 1) + 1
+
+    def _wdeg(self, var):
+        return sum(self.weights.get(c, 1) for c in self.csp.constraintsOf(var))
+
+    def _best(self, key):
+        if self._rng is None:
+            return min(self.unassigned, key=key)
+        scores = [key(v) for v in self.unassigned]
+        best = min(scores)
+        return self._rng.choice([v for (v, score) in zip(self.unassigned, scores) if score == best])
+
     def extract(self):
         if not self.unassigned:
             pass #print "Warning, extracting from empty unassigned list"
             return None
         if self._select == 'random':
-            i = random.randint(0,len(self.unassigned)-1)
+            if self._rng is None:
+                i = random.randint(0,len(self.unassigned)-1)
+            else:
+                i = self._rng.randint(0,len(self.unassigned)-1)
             nxtvar = self.unassigned[i]
             self.unassigned[i] = self.unassigned[-1]
             self.unassigned.pop()
@@ -38,7 +68,11 @@ class UnassignedVars:
         if self._select == 'fixed':
             return self.unassigned.pop()
         if self._select == 'mrv':
-            nxtvar = min(self.unassigned, key=lambda v: v.curDomainSize())
+            nxtvar = self._best(lambda v: v.curDomainSize())
+            self.unassigned.remove(nxtvar)
+            return nxtvar
+        if self._select == 'domwdeg':
+            nxtvar = self._best(lambda v: float(v.curDomainSize()) / self._wdeg(v))
             self.unassigned.remove(nxtvar)
             return nxtvar
 
@@ -53,82 +87,484 @@ class UnassignedVars:
 
 
 
-def bt_search(algo, csp, variableHeuristic, allSolutions, trace, piece_constraint, originalB, givens, size):
+class ValueOrder:
+    '''class for ordering the values GAC tries for the variable it
+       branches on. Object is initialized by passing an order_criteria,
+       the CSP object (built like BattleshipModel's: cell variables
+       named str(-1-(i*size+j)) with values 0/1 and glyph variables
+       named str(i*size+j) with values '.'/'S'), the puzzle's givens,
+       the padded board size and the fleet string.
+
+       order_criteria = ['domain', 'lcv', 'prob', 'hints'] with
+       'domain' == follow the order of the current domain
+       'lcv'    == least constraining value first: each value is tried,
+                   propagated with GacEnforce and undone, and values are
+                   ordered by the number of values they prune. Results
+                   are cached by the current domains of the variables
+                   the variable shares a constraint with
+       'prob'   == ship first if the remaining row and column sums make
+                   a ship more likely than water for the cell
+       'hints'  == ship first for cells within reach of a ship part hint
+                   (same row/column, closer than the longest ship),
+                   water first elsewhere
+
+       lcvTrials and lcvCacheHits count the trial propagations done and
+       saved.
+    '''
+    def __init__(self, order_criteria, csp, given, size, piece_constraint):
+        if order_criteria not in ['domain', 'lcv', 'prob', 'hints']:
+            pass #print "Error ValueOrder given an illegal order criteria {}".format(order_criteria)
+        self.csp = csp
+        self._order = order_criteria
+        self.size = size
+        self.lcvTrials = 0
+        self.lcvCacheHits = 0
+        self._cache = dict()
+        self._neighbours = dict()
+        self._cellvar = dict((v.name(), v) for v in csp.variables() if int(v.name()) < 0)
+
+        longest = max([L for L in range(1, len(piece_constraint) + 1) if int(piece_constraint[L-1]) > 0] + [1])
+        self._nearHints = set()
+        for (i, j, ch) in given:
+            if ch != '.':
+                for d in range(-longest + 1, longest):
+                    if 1 <= i + d <= size - 2:
+                        self._nearHints.add((i + d) * size + j)
+                    if 1 <= j + d <= size - 2:
+                        self._nearHints.add(i * size + j + d)
+
+    def _cell(self, var):
+        '''return the board index and 0/1 variable of var'''
+        k = int(var.name())
+        if k < 0:
+            return -1 - k, var
+        return k, self._cellvar[str(-1 - k)]
+
+    @staticmethod
+    def _isShip(val):
+        return val == 1 or val == 'S'
+
+    def order(self, var):
+        '''return the values of var's current domain in the order to try them'''
+        vals = var.curDomain()
+        if len(vals) < 2 or self._order not in ['lcv', 'prob', 'hints']:
+            return vals
+        if self._order == 'lcv':
+            return sorted(vals, key=lambda val: self._prunings(var, val))
+        k, cellvar = self._cell(var)
+        if self._order == 'prob':
+            shipFirst = self._shipProbability(cellvar) >= 0.5
+        else:
+            shipFirst = k in self._nearHints
+        return sorted(vals, key=lambda val: self._isShip(val) != shipFirst)
+
+    def _shipProbability(self, cellvar):
+        p = []
+        for c in self.csp.constraintsOf(cellvar):
+            if c.name() in ('NValues_row', 'NValues_col'):
+                ships = 0
+                unknown = 0
+                for v in c.scope():
+                    if v.curDomainSize() == 2:
+                        unknown += 1
+                    elif v.inCurDomain(1):
+                        ships += 1
+                if unknown:
+                    p.append(float(c.bounds()[0] - ships) / unknown)
+        return sum(p) / len(p) if p else 0
+
+    def _prunings(self, var, val):
+        '''number of values var=val prunes (a wipe out counts as everything)'''
+        if var not in self._neighbours:
+            nbrs = set()
+            for c in self.csp.constraintsOf(var):
+                if not hasattr(c, 'propagate'):
+                    nbrs.update(c.scope())
+            self._neighbours[var] = sorted(nbrs, key=lambda v: int(v.name()))
+        key = (var, val, tuple(tuple(sorted(v.curDomain())) for v in self._neighbours[var]))
+        if key in self._cache:
+            self.lcvCacheHits += 1
+            return self._cache[key]
+
+        self.lcvTrials += 1
+        #trial propagations are not part of the search, keep them out of the trace
+        trace = bt_search.trace
+        bt_search.trace = None
+        var.setValue(val)
+        if GacEnforce(self.csp.constraintsOf(var), self.csp, var, val):
+            pruned = len(Variable.undoDict.get((var, val), []))
+        else:
+            pruned = float('inf')
+        Variable.restoreValues(var, val)
+        var.unAssign()
+        bt_search.trace = trace
+        self._cache[key] = pruned
+        return pruned
+
+
+class SearchCutoff(Exception):
+    '''Raised by SearchBudget.check to abandon a run of GAC (to restart it)'''
+    pass
+
+
+class SearchTimeout(SearchCutoff):
+    '''Raised by SearchBudget.check to abandon the search altogether,
+       status is 'timeout' or 'cancelled'.'''
+    def __init__(self, status):
+        SearchCutoff.__init__(self, status)
+        self.status = status
+
+
+class SearchBudget:
+    '''Limits on a run of GAC. check() is called at every node with the
+       number of nodes and of decisions (nodes with more than one value
+       to try) explored so far. It raises
+
+         - SearchCutoff once decisionLimit is exceeded (used for restarts),
+         - SearchTimeout('timeout') once nodeLimit is exceeded or the
+           wall-clock time.time() passes deadline,
+         - SearchTimeout('cancelled') once cancel (any object with an
+           is_set() method, e.g. a threading.Event set from another
+           thread or an asyncio task) is set.
+
+       The limits are None when there is none. GAC stops once it has
+       found solutionLimit solutions (None for all of them).'''
+    def __init__(self, nodeLimit=None, decisionLimit=None, solutionLimit=1, deadline=None, cancel=None):
+        self.nodeLimit = nodeLimit
+        self.decisionLimit = decisionLimit
+        self.solutionLimit = solutionLimit
+        self.deadline = deadline
+        self.cancel = cancel
+
+    def check(self, nodes, decisions):
+        if self.cancel is not None and self.cancel.is_set():
+            raise SearchTimeout('cancelled')
+        if self.deadline is not None and time.time() > self.deadline:
+            raise SearchTimeout('timeout')
+        if self.nodeLimit is not None and nodes > self.nodeLimit:
+            raise SearchTimeout('timeout')
+        if self.decisionLimit is not None and decisions > self.decisionLimit:
+            raise SearchCutoff()
+
+
+class Prober:
+    '''Singleton arc consistency by failed literal probing on the 0/1 cell
+       variables: each undecided cell is tentatively made ship and water
+       and propagated with GacEnforce (incrementally, from the cell's
+       constraints). A value whose propagation wipes out a domain is
+       pruned for good and propagated, and the cells are probed again
+       until none fails.
+
+       GAC probes at the root and after the decisions at most depth
+       decisions deep (not after the forced assignments), with at most limit probes per node (None for no limit).
+       probes, fixed (values pruned by failed probes) and time (seconds
+       spent probing) are the statistics.'''
+    def __init__(self, csp, depth=0, limit=None):
+        self.cells = [v for v in csp.variables() if int(v.name()) < 0]
+        self.depth = depth
+        self.limit = limit
+        self.probes = 0
+        self.fixed = 0
+        self.time = 0.0
+
+    def probe(self, csp, reasonVar, reasonVal, budget):
+        '''probe the undecided cells, recording the prunings under
+           (reasonVar, reasonVal) so that they are undone with the
+           assignment. Returns False if the node has no solution.'''
+        t_start = time.time()
+        count = 0
+        #only the failed probes are traced, not their propagation
+        trace = bt_search.trace
+        bt_search.trace = None
+        try:
+            changed = True
+            while changed:
+                changed = False
+                for var in self.cells:
+                    for val in var.curDomain() if var.curDomainSize() == 2 else []:
+                        if self.limit is not None and count >= self.limit:
+                            return True
+                        budget.check(bt_search.nodesExplored, bt_search.decisions)
+                        count += 1
+                        self.probes += 1
+                        var.setValue(val)
+                        ok = GacEnforce(csp.constraintsOf(var), csp, var, val)
+                        Variable.restoreValues(var, val)
+                        var.unAssign()
+                        if not ok:
+                            self.fixed += 1
+                            if trace is not None:
+                                trace.probe(var, val)
+                            var.pruneValue(val, reasonVar, reasonVal)
+                            if not GacEnforce(csp.constraintsOf(var), csp, reasonVar, reasonVal):
+                                return False
+                            # the pruning may make earlier probes fail, probe again
+                            changed = True
+                            break
+            return True
+        finally:
+            bt_search.trace = trace
+            self.time += time.time() - t_start
+
+
+def luby(i):
+    '''i-th term (from 1) of the Luby sequence 1,1,2,1,1,2,4,1,1,2,...'''
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    if i == (1 << k) - 1:
+        return 1 << (k - 1)
+    return luby(i - (1 << (k - 1)) + 1)
+
+def restart_cutoffs(restarts, restartBase):
+    '''generate the node limits of the successive runs of a restart
+       strategy, restarts is one of ['luby', 'geometric']'''
+    run = 1
+    while True:
+        if restarts == 'luby':
+            yield restartBase * luby(run)
+        else:
+            yield int(restartBase * 1.5 ** (run - 1))
+        run += 1
+
+
+def bt_search(algo, csp, variableHeuristic, allSolutions, trace, piece_constraint, originalB, givens, size, valueHeuristic='domain',
+              restarts=None, seed=None, restartBase=100, solutionLimit=None, timeLimit=None, nodeLimit=None, cancel=None,
+              probeDepth=None, probeLimit=None):
     '''Main interface routine for calling different forms of backtracking search
        algorithm is one of ['BT', 'FC', 'GAC']
        csp is a CSP object specifying the csp problem to solve
-       variableHeuristic is one of ['random', 'fixed', 'mrv']
-       allSolutions True or False. True means we want to find all solutions.
-       trace True of False. True means turn on tracing of the algorithm
+       variableHeuristic is one of ['random', 'fixed', 'mrv', 'domwdeg']
+       allSolutions True or False. True means we want to find all solutions
+       (or, if solutionLimit is given, up to solutionLimit of them, e.g.
+       2 to tell if a puzzle has a unique solution).
+       trace is None (or False), a file path or a TraceWriter: write a
+       binary trace of the search (see searchtrace.py, its replay tool)
+       to it. A path is opened and closed here, a TraceWriter is only
+       flushed.
+       valueHeuristic is one of ['domain', 'lcv', 'prob', 'hints'] (see ValueOrder)
+       restarts is None or one of ['luby', 'geometric']: restart the
+       search after restartBase times the next term of the Luby sequence
+       (or 1.5**run) decisions, i.e. nodes with more than one value to
+       try (forced assignments are not counted). Ties between variables are then broken at
+       random and the 'domwdeg' weights are carried across restarts.
+       seed seeds the random choices so that searches are reproducible.
+       timeLimit (seconds) and nodeLimit bound the whole search and
+       cancel (e.g. a threading.Event) stops it when set, see SearchBudget.
+       probeDepth turns on failed literal probing (see Prober) at the
+       root and down to probeDepth decisions deep, with at most
+       probeLimit probes per node; bt_search.probes, probeFixed and
+       probeTime are then its statistics.
+
+       bt_search.status tells how the search ended: 'solved', 'unsat',
+       'timeout' or 'cancelled'. In the last two cases the solutions
+       found so far are returned and bt_search.partial holds the partial
+       assignment the search stopped at (the (var, value) pairs of the
+       cell variables, 1 ship / 0 water, with a single value left), taken
+       only then; bt_search.partialDepth is the deepest depth reached.
 
        bt_search returns a list of solutions. Each solution is itself a list
        of pairs (var, value). Where var is a Variable object, and value is
        a value from its domain.
     '''
-    varHeuristics = ['random', 'fixed', 'mrv']
+    varHeuristics = ['random', 'fixed', 'mrv', 'domwdeg']
     algorithms = ['BT', 'FC', 'GAC']
 
     #statistics
     bt_search.nodesExplored = 0
+    bt_search.lcvTrials = 0
+    bt_search.lcvCacheHits = 0
+    bt_search.decisions = 0
+    bt_search.restarts = 0
+    bt_search.status = None
+    bt_search.partial = []
+    bt_search.partialDepth = -1
+    bt_search.probes = 0
+    bt_search.probeFixed = 0
+    bt_search.probeTime = 0.0
 
     if variableHeuristic not in varHeuristics:
         pass 
     if algo not in algorithms:
         pass
 
-    uv = UnassignedVars(variableHeuristic,csp)
-    Variable.clearUndoDict()
-    for v in csp.variables():
-        v.reset()
-
-    if algo == 'GAC':
-        GacEnforce(csp.constraints(), csp, None, None) #GAC at the root
-        solutions = GAC(uv, csp, originalB, piece_constraint, givens, size)
+    rng = None
+    if seed is not None or restarts is not None:
+        rng = random.Random(seed)
+    weights = dict()
+    vo = ValueOrder(valueHeuristic, csp, givens, size, piece_constraint)
+    cutoffs = restart_cutoffs(restarts, restartBase) if restarts is not None else None
+    deadline = time.time() + timeLimit if timeLimit is not None else None
+    prober = Prober(csp, probeDepth, probeLimit) if probeDepth is not None else None
+    solutions = []
+    if isinstance(trace, str):
+        bt_search.trace = TraceWriter(trace, csp, size)
+    else:
+        bt_search.trace = trace or None
+
+    try:
+        while True:
+            uv = UnassignedVars(variableHeuristic, csp, rng, weights)
+            budget = SearchBudget(nodeLimit, None, solutionLimit if allSolutions else 1, deadline, cancel)
+            if cutoffs is not None:
+                budget.decisionLimit = bt_search.decisions + next(cutoffs)
+            Variable.clearUndoDict()
+            for v in csp.variables():
+                v.reset()
+
+            try:
+                if algo == 'GAC':
+                    consistent = GacEnforce(csp.constraints(), csp, None, None) #GAC at the root
+                    if consistent and prober is not None:
+                        consistent = prober.probe(csp, None, None, budget)
+                    if consistent:
+                        solutions = GAC(uv, csp, originalB, piece_constraint, givens, size, vo, budget, prober)
+                    else:
+                        solutions = []
+                bt_search.status = 'solved' if solutions else 'unsat'
+                break
+            except SearchTimeout as e:
+                #GAC does not undo its assignments on the way out, the
+                #domains are still those of the node that stopped
+                bt_search.partial = [(var, var.curDomain()[0]) for var in csp.variables()
+                                     if int(var.name()) < 0 and var.curDomainSize() == 1]
+                bt_search.status = e.status
+                solutions = e.solutions if hasattr(e, 'solutions') else []
+                break
+            except SearchCutoff:
+                bt_search.restarts += 1
+                if bt_search.trace is not None:
+                    bt_search.trace.restart()
+    finally:
+        if isinstance(trace, str):
+            bt_search.trace.close()
+        elif bt_search.trace is not None:
+            bt_search.trace.flush()
+        bt_search.trace = None
+
+    bt_search.lcvTrials = vo.lcvTrials
+    bt_search.lcvCacheHits = vo.lcvCacheHits
+    if prober is not None:
+        bt_search.probes = prober.probes
+        bt_search.probeFixed = prober.fixed
+        bt_search.probeTime = prober.time
 
     return solutions, bt_search.nodesExplored
 
+#the TraceWriter of the running search, if tracing
+bt_search.trace = None
+
 def GacEnforce(constraint_csp, csp, assignedvar, assignedval):
-    constraint_csp = csp.constraints()
-    while len(constraint_csp) != 0:
-        cnstr = constraint_csp.pop()
-        for var in cnstr.scope():
-            for val in var.curDomain():
-                if not cnstr.hasSupport(var,val):
-                    var.pruneValue(val,assignedvar,assignedval)
-                    if var.curDomainSize() == 0:
-                        return False #DWO
-                    for recheck in csp.constraintsOf(var):
-                        if recheck != cnstr and recheck not in constraint_csp:
-                            constraint_csp.append(recheck)
+    '''Enforce GAC after assignedvar=assignedval, starting from the
+       constraints in constraint_csp (those of assignedvar, or all of
+       them at the root): only the constraints of the variables that
+       lose values are rechecked. Returns False on a domain wipe out,
+       GacEnforce.wipeout is then the constraint that caused it. The
+       values each constraint prunes and the wipeouts go to
+       bt_search.trace when tracing.'''
+    trace = bt_search.trace
+    #global constraints (those with a propagate method) are only run once
+    #the others have reached their fixpoint
+    global_csp = [c for c in constraint_csp if hasattr(c, 'propagate')]
+    constraint_csp = [c for c in constraint_csp if not hasattr(c, 'propagate')]
+
+    def requeue(var, cnstr):
+        for recheck in csp.constraintsOf(var):
+            queue = global_csp if hasattr(recheck, 'propagate') else constraint_csp
+            if recheck != cnstr and recheck not in queue:
+                queue.append(recheck)
+
+    while len(constraint_csp) != 0 or len(global_csp) != 0:
+        while len(constraint_csp) != 0:
+            cnstr = constraint_csp.pop()
+            count = 0
+            if hasattr(cnstr, 'supports'):
+                cnstr.supports()
+            for var in cnstr.scope():
+                for val in var.curDomain():
+                    if not cnstr.hasSupport(var,val):
+                        var.pruneValue(val,assignedvar,assignedval)
+                        count += 1
+                        if var.curDomainSize() == 0:
+                            GacEnforce.wipeout = cnstr
+                            if trace is not None:
+                                trace.propagate(cnstr, count)
+                                trace.wipeout(cnstr)
+                            return False #DWO
+                        requeue(var, cnstr)
+            if count and trace is not None:
+                trace.propagate(cnstr, count)
+        if len(global_csp) != 0:
+            cnstr = global_csp.pop()
+            pruned = cnstr.propagate(assignedvar, assignedval)
+            if pruned is None:
+                GacEnforce.wipeout = cnstr
+                if trace is not None:
+                    trace.wipeout(cnstr)
+                return False #DWO
+            if pruned and trace is not None:
+                trace.propagate(cnstr, len(pruned))
+            for var in pruned:
+                requeue(var, cnstr)
     return True
 
-def GAC(unAssignedVars, csp, originalB, p_c, given, size):
+def GAC(unAssignedVars, csp, originalB, p_c, given, size, valueOrder, budget, prober=None, level=0):
+    '''level is the number of decisions above this node, the decisions at
+       most prober.depth deep are probed (see Prober)'''
+    trace = bt_search.trace
     if unAssignedVars.empty():
-
+        if trace is not None:
+            trace.solution(len(csp.variables()))
         sol = []
         for var in csp.variables():
             if int(var._name) > 0:  
                 sol.append((var,var.getValue()))
         return [sol]
     bt_search.nodesExplored += 1
+    depth = len(csp.variables()) - len(unAssignedVars.unassigned)
+    if depth > bt_search.partialDepth:
+        bt_search.partialDepth = depth
     all_sol = []
     nxtvar = unAssignedVars.extract()
-    for val in nxtvar.curDomain():
+    vals = valueOrder.order(nxtvar)
+    if len(vals) > 1:
+        bt_search.decisions += 1
+        level += 1
+    if trace is not None:
+        trace.node(depth, nxtvar, len(vals))
+    budget.check(bt_search.nodesExplored, bt_search.decisions)
+    for val in vals:
         nxtvar.setValue(val)
-
-        if GacEnforce(csp.constraintsOf(nxtvar), csp, nxtvar, val) and not prune_ship_counts(csp, p_c, size) and not prune(csp, given, size):
-            new_sol = GAC(unAssignedVars, csp, originalB, p_c, given, size)
-            if new_sol:
-                five, four, three, two, one, st = count_ship(new_sol[0], size)
-                if one == int(p_c[0]) and two == int(p_c[1]) and three == int(p_c[2]) and four == int(p_c[3]) and five == int(p_c[4]):
-
-                    if (vfy_to_org(originalB, st, size)):
-                        all_sol.extend(new_sol)
-                        if len(all_sol) > 0:
-                            break
+        if trace is not None:
+            trace.assign(depth, nxtvar, val)
+
+        consistent = GacEnforce(csp.constraintsOf(nxtvar), csp, nxtvar, val)
+        if not consistent:
+            unAssignedVars.conflict(GacEnforce.wipeout)
+        new_sol = []
+        try:
+            if consistent and prober is not None and len(vals) > 1 and level <= prober.depth:
+                consistent = prober.probe(csp, nxtvar, val, budget)
+            if consistent and not prune(csp, given, size):
+                new_sol = GAC(unAssignedVars, csp, originalB, p_c, given, size, valueOrder, budget, prober, level)
+        except SearchTimeout as e:
+            #hand the solutions found so far up to bt_search
+            e.solutions = all_sol + getattr(e, 'solutions', [])
+            raise
+        if new_sol:
+            counts, st = count_ship(new_sol[0], size)
+            if all(counts[L] == (int(p_c[L-1]) if L <= len(p_c) else 0) for L in range(1, len(counts))):
+
+                if (vfy_to_org(originalB, st, size)):
+                    all_sol.extend(new_sol)
+                    if budget.solutionLimit is not None and len(all_sol) >= budget.solutionLimit:
+                        del all_sol[budget.solutionLimit:]
+                        break
         nxtvar.restoreValues(nxtvar,val)
     nxtvar.unAssign()
     unAssignedVars.insert(nxtvar)
+    if trace is not None and not all_sol:
+        trace.backtrack(depth, nxtvar)
     return all_sol
 
 
@@ -178,181 +614,67 @@ def prune_ship_counts(csp, p_c, size):
     for var in csp.variables():
         if int(var._name) > 0:
             n_sol.append((var,var.getValue()))
-    n5, n4, n3, n2, n1, st = pruning_ship_numbers(n_sol, size)
-    if n1 > int(p_c[0]) or n2 > int(p_c[1]) or n3 > int(p_c[2]) or n4 > int(p_c[3]) or n5 > int(p_c[4]):
-         return True
+    counts, st = pruning_ship_numbers(n_sol, size)
+    for L in range(1, len(counts)):
+        if counts[L] > (int(p_c[L-1]) if L <= len(p_c) else 0):
+            return True
     return False
 
-    
-def pruning_ship_numbers(sol, size):
-
-    # A helper function to check if cells are already part of another ship
-    def istoverlap(i, j, length, direction, st):
-        if direction == "vertical":
-            for k in range(length):
-                if st.get(((i + k) * size + j)) not in ("S", None):
-                    return True
-        elif direction == "horizontal":
-            for k in range(length):
-                if st.get((i * size + j + k)) not in ("S", None):
-                    return True
-        return False
-    
-    st = {}
-    for (var, val) in sol:
-        st[int(var.name())] = val
 
+def mark_ships(st, size, complete=False):
+    '''Replace the 'S' cells of st (the glyphs of a padded board indexed
+       by i*size+j, None for unassigned cells) by the glyphs of the
+       ships they form: '<' 'M' '>' or '^' 'M' 'v', 'S' for length 1.
+       Each ship is found as a run of 'S' cells from its top/left cell,
+       whatever its length.
 
-    one = 0
-    two = 0
-    three = 0
-    four = 0
-    five = 0 
+       Returns counts, counts[L] being the number of ships of length L.
+       With complete, only the ships with water ('.' or the border) at
+       both ends are marked and counted.'''
+    counts = [0] * size
     for i in range(1, size-1):
         for j in range(1, size-1):
-            # vertical
-            below = None
-            above = None
-            right = None
-            left = None
-            # for ships of size five
-            if (i < (size - 5) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S" and st[((i+3)*size+j)] == "S" and st[((i+4)*size+j)] == "S" and not istoverlap(i, j, 5, "vertical", st)):
-                 
-                five += 1
-                st[((i)*size+j)] = "^"
-                st[((i+1)*size+j)] = "M"
-                st[((i+2)*size+j)] = "M"
-                st[((i+3)*size+j)] = "M"
-                st[((i+4)*size+j)] = "v"
-            # for ships of size four
-            elif (i < (size - 4) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S" and st[((i+3)*size+j)] == "S" and not istoverlap(i, j, 4, "vertical", st)):
-                four += 1
-                st[((i)*size+j)] = "^"
-                st[((i+1)*size+j)] = "M"
-                st[((i+2)*size+j)] = "M"
-                st[((i+3)*size+j)] = "v"
-            elif (i < (size - 3) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S" and not istoverlap(i, j, 3, "vertical", st)):
-                if i != size - 4:
-                    below = st[((i+3)*size+j)]
-                if i != 1:
-                    above = st[((i-1)*size+j)]
-                if below == "." and above == ".":
-                    three += 1
-                    st[((i)*size+j)] = "^"
-                    st[((i+1)*size+j)]= "M"
-                    st[((i+2)*size+j)] = "v"
-            elif (i < (size - 2) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and not istoverlap(i, j, 2, "vertical", st)):
-                if i != size - 3:
-                    below = st[((i+2)*size+j)]
-                if i != 1:
-                    above = st[((i-1)*size+j)]
-                if below == "." and above == ".":
-                    two += 1
-                    st[((i)*size+j)] = "^"
-                    st[((i+1)*size+j)] = "v"
-
-
-            # horizontal 
-            if (j < (size - 5) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S" and st[(i*size+j+3)] == "S" and st[(i*size+j+4)] == "S" and not istoverlap(i, j, 5, "horizontal", st)):
-                five += 1
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1 )] ="M"
-                st[(i*size+j+2 )] ="M"
-                st[(i*size+j+3 )] ="M"
-                st[(i*size+j+4 )] =">"
-            elif (j < (size - 4) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S" and st[(i*size+j+3)] == "S" and not istoverlap(i, j, 4, "horizontal", st)):
-                four += 1
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1 )] ="M"
-                st[(i*size+j+2 )] ="M"
-                st[(i*size+j+3 )] =">"
-            elif (j < (size - 3) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S" and not istoverlap(i, j, 3, "horizontal", st)):
-                if j != size - 4:
-                    right = st[(i*size+j+3)] 
-                if j != 1:
-                    left = st[(i*size+j-1)]
-                if right == "." and left == ".":
-                    three += 1
-                    st[(i*size+j)] = "<"
-                    st[(i*size+j+1)] = "M"
-                    st[(i*size+j+2)] = ">"
-            elif (j < (size - 2) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and not istoverlap(i, j, 2, "horizontal", st)):
-                if j != size - 3:
-                    right = st[(i*size+j+2)] 
-                if j != 1:
-                    left = st[(i*size+j-1)]
-                if right == "." and left == ".":
-                    two += 1
-                    st[(i*size+j)] = "<"
-                    st[(i*size+j+1)] = ">"
-            
-       # Check for lone ship parts (size 1)
-    for i in range(1, size - 1):
-        for j in range(1, size - 1):
-            if (
-                st[(i * size + j)] == "S"
-                and all(
-                    st.get((i + di) * size + j + dj, ".") == "."
-                    for di, dj in [
-                        (-1, 0), (1, 0), (0, -1), (0, 1),  # Adjacent directions
-                        (-1, -1), (-1, 1), (1, -1), (1, 1)  # Diagonal directions
-                    ]
-                )
-            ):
-                one += 1
-    
-    return five, four, three, two, one, st
+            k = i*size+j
+            if st.get(k) != "S":
+                continue
+            if st.get(k+1) == "S":
+                step, glyphs = 1, ("<", ">")
+            elif st.get(k+size) == "S":
+                step, glyphs = size, ("^", "v")
+            else:
+                step, glyphs = 1, None
+            L = 1
+            while st.get(k+L*step) == "S":
+                L += 1
+            if complete:
+                ends = [k-step, k+L*step] if glyphs else [k-1, k+1, k-size, k+size]
+                if any(st.get(e, ".") != "." for e in ends):
+                    continue
+            counts[L] += 1
+            if glyphs:
+                st[k] = glyphs[0]
+                for m in range(1, L-1):
+                    st[k+m*step] = "M"
+                st[k+(L-1)*step] = glyphs[1]
+    return counts
 
 
+def pruning_ship_numbers(sol, size):
+    '''count the complete ships of the partial solution sol, returns
+       (counts, st) as mark_ships'''
+    st = {}
+    for (var, val) in sol:
+        st[int(var.name())] = val
+    counts = mark_ships(st, size, True)
+    return counts, st
+
 
 def print_sol(sol, size):
     st = {}
     for (var, val) in sol:
         st[int(var.name())] = val
+    mark_ships(st, size)
 
-    for i in range(1, size-1):
-        for j in range(1, size-1):
-            # For ships of size 5 SSSSS
-            if j < (size - 4) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S" and st[(i*size+j+3)] == "S" and st[(i*size+j+4)] == "S":
-               st[(i*size+j)] = "<"
-               st[(i*size+j+1 )] ="M"
-               st[(i*size+j+2 )] ="M"
-               st[(i*size+j+3 )] = "M"
-               st[(i*size+j+4 )] =">"
-            # SSSS
-            elif j < (size - 3) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S" and st[(i*size+j+3)] == "S":
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1 )] ="M"
-                st[(i*size+j+2 )] ="M"
-                st[(i*size+j+3 )] =">"
-            elif j < (size - 2) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S":
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1)] = "M"
-                st[(i*size+j+2)] = ">"
-            elif j < (size - 1) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S":
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1)] = ">"
-
-            # vertical 5 size
-            if i < (size - 4) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S" and st[((i+3)*size+j)] == "S" and st[((i+4)*size+j)] == "S":
-                st[(i*size+j)] = "^"
-                st[(i*size+j+1 )] ="M"
-                st[(i*size+j+2 )] ="M"
-                st[(i*size+j+3 )] = "M"
-                st[(i*size+j+4 )] = "v"
-            elif i < (size - 3) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S" and st[((i+3)*size+j)] == "S":
-                st[((i)*size+j)] = "^"
-                st[((i+1)*size+j)] = "M"
-                st[((i+2)*size+j)] = "M"
-                st[((i+3)*size+j)] = "v"
-            elif i < (size - 2) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S":
-                st[((i)*size+j)] = "^"
-                st[((i+1)*size+j)]= "M"
-                st[((i+2)*size+j)] = "v"
-            elif i < (size - 1) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S":
-                st[((i)*size+j)] = "^"
-                st[((i+1)*size+j)] = "v"
-        
     for i in range(1, size-1):
         for j in range(1, size-1):
             if st[(i*size+j)] == None:
@@ -362,69 +684,11 @@ def print_sol(sol, size):
         print('')
 
 def count_ship(sol, size):
-
+    '''count the ships of the solution sol by length, returns (counts,
+       st): counts[L] the number of ships of length L and st the glyphs
+       of the board, see mark_ships'''
     st = {}
     for (var, val) in sol:
         st[int(var.name())] = val
-
-    one = 0
-    two = 0
-    three = 0
-    four = 0
-    five = 0 
-    for i in range(1, size-1):
-        for j in range(1, size-1):
-            # For Ship size of 5 SSSSS vertical 
-            if (i < (size - 4) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S" and st[((i+3)*size+j)] == "S" and st[((i+4)*size+j)] == "S"):
-                five += 1
-                st[(i*size+j)] = "^"
-                st[(i*size+j+1 )] ="M"
-                st[(i*size+j+2 )] ="M"
-                st[(i*size+j+3 )] = "M"
-                st[(i*size+j+4 )] ="v"
-            elif (i < (size - 4) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S" and st[((i+3)*size+j)] == "S"):
-                four += 1
-                st[((i)*size+j)] = "^"
-                st[((i+1)*size+j)] = "M"
-                st[((i+2)*size+j)] = "M"
-                st[((i+3)*size+j)] = "v"
-            elif (i < (size - 3) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S" and st[((i+2)*size+j)] == "S"):
-                three += 1
-                st[((i)*size+j)] = "^"
-                st[((i+1)*size+j)]= "M"
-                st[((i+2)*size+j)] = "v"
-            elif (i < (size - 2) and st[(i*size+j)] == "S" and st[((i+1)*size+j)] == "S"):
-                two += 1
-                st[((i)*size+j)] = "^"
-                st[((i+1)*size+j)] = "v"
-            
-            if (j < (size - 4) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S" and st[(i*size+j+3)] == "S" and st[(i*size+j+4)] == "S"):
-                five += 1
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1 )] ="M"
-                st[(i*size+j+2 )] ="M"
-                st[(i*size+j+3 )] = "M"
-                st[(i*size+j+4 )] =">"
-            elif (j < (size - 4) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S" and st[(i*size+j+3)] == "S"):
-                four += 1
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1 )] ="M"
-                st[(i*size+j+2 )] ="M"
-                st[(i*size+j+3 )] =">"
-            elif (j < (size - 3) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S" and st[(i*size+j+2)] == "S"):
-                three += 1
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1)] = "M"
-                st[(i*size+j+2)] = ">"
-            elif (j < (size - 2) and st[(i*size+j)] == "S" and st[(i*size+j+1)] == "S"):
-                two += 1
-                st[(i*size+j)] = "<"
-                st[(i*size+j+1)] = ">"
-            
-    for i in range(1, size-1):
-        for j in range(1, size-1):
-            if st[(i*size+j)] == "S":
-                one += 1
-    return five, four, three, two, one, st
-
-
+    counts = mark_ships(st, size)
+    return counts, st
@@ -3,143 +3,142 @@ import argparse
 from csp import Constraint, Variable, CSP
 from constraints import *
 from backtracking import * 
+from model import Puzzle, BattleshipModel, parse_puzzle, memory_report
+from stream import solve_stream
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--inputfile",
         type=str,
-        required=True,
         help="The input file that contains the puzzle."
     )
     parser.add_argument(
         "--outputfile",
         type=str,
-        required=True,
         help="The output file that contains the solution."
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Solve a blank line separated stream of puzzles from stdin to stdout instead."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of worker processes in --stream mode."
+    )
+    parser.add_argument(
+        "--inflight",
+        type=int,
+        default=None,
+        help="The most puzzles in flight in --stream mode (default 2 per worker)."
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="In --stream mode, follow every solution by a line of JSON metadata (time, nodes)."
+    )
+    parser.add_argument(
+        "--backend",
+        choices=['GAC', 'SAT'],
+        default='GAC',
+        help="Solve with backtracking search (GAC) or the CDCL SAT solver (SAT)."
+    )
+    parser.add_argument(
+        "--varorder",
+        choices=['mrv', 'domwdeg', 'fixed', 'random'],
+        default='mrv',
+        help="The variable ordering heuristic used by the search."
+    )
+    parser.add_argument(
+        "--valueorder",
+        choices=['domain', 'lcv', 'prob', 'hints'],
+        default='domain',
+        help="The value ordering heuristic used by the search."
+    )
+    parser.add_argument(
+        "--restarts",
+        choices=['luby', 'geometric'],
+        default=None,
+        help="Restart the search on a Luby or geometric schedule."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for the random tie-breaking, for reproducible searches."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Give up after this many seconds."
+    )
+    parser.add_argument(
+        "--nodelimit",
+        type=int,
+        default=None,
+        help="Give up after exploring this many nodes (decisions for SAT)."
+    )
+    parser.add_argument(
+        "--probe",
+        type=int,
+        default=None,
+        help="Probe failed literals at the root and down to this many decisions deep (GAC)."
+    )
+    parser.add_argument(
+        "--probelimit",
+        type=int,
+        default=None,
+        help="At most this many probes per node."
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Write a binary trace of the GAC search to this file (summarise it with searchtrace.py)."
+    )
+    parser.add_argument(
+        "--nodecompose",
+        action="store_true",
+        help="Do not split the board into independent regions."
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="Print the memory held by the model of the puzzle's size."
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print presolve and search statistics."
+    )
     
     args = parser.parse_args()
+    if args.stream:
+        options = {'algo': args.backend, 'variableHeuristic': args.varorder, 'valueHeuristic': args.valueorder,
+                   'restarts': args.restarts, 'seed': args.seed, 'timeLimit': args.timeout, 'nodeLimit': args.nodelimit,
+                   'decompose': not args.nodecompose, 'probeDepth': args.probe, 'probeLimit': args.probelimit}
+        solve_stream(sys.stdin, sys.stdout, args.workers, args.inflight, args.json, options)
+        sys.exit(0)
+    if args.inputfile is None or args.outputfile is None:
+        parser.error("--inputfile and --outputfile are required (unless --stream)")
     
     file = open(args.inputfile, 'r')
-    b = file.read()
-    b2 = b.split()
-    piece_constraint = b2[2]
-    size = len(b2[0])
-    size = size + 2
-    b3 = []
-    b3 += ['0' + b2[0] + '0']
-    b3 += ['0' + b2[1] + '0']
-    b3 += [b2[2] + ('0' if len(b2[2]) == 3 else '')]
-    b3 += ['0' * size]
-    for i in range(3, len(b2)):
-        b3 += ['0' + b2[i] + '0']
-    b3 += ['0' * size]
-    board = "\n".join(b3)
-
-    varlist = []
-    varn = {}
-    conslist = []
-
-    given = []
-
-    originalB = board.split()[3:]
-
-    row_constraint = []
-    for i in board.split()[0]:
-        row_constraint += [int(i)]
-
-    col_constraint = []
-    for i in board.split()[1]:
-        col_constraint += [int(i)]
-
-    # Convert originalB rows to lists for mutability
-    originalB = [list(row) for row in originalB]
-
-    # Preprocessing rows/columns with zero constraints
-    for i in range(size):
-        if row_constraint[i] == 0:  # Row with 0 ships
-            for j in range(1, size - 1):
-                originalB[i][j - 1] = "."  # Mark entire row as water
+    puzzle = parse_puzzle(file.read())
+    file.close()
+    size = puzzle.size
 
-        if col_constraint[i] == 0:  # Column with 0 ships
-            for j in range(1, size - 1):
-                originalB[j - 1][i] = "."  # Mark entire column as water
-
-    # Directions for neighbors based on ship parts
-    directions = {
-        "<": [(-1, 0), (1, 0), (0, -1), (-1, -1), (1, -1)],  # Left, Top, Bottom, Diagonals
-        ">": [(-1, 0), (1, 0), (0, 1), (-1, 1), (1, 1)],    # Right, Top, Bottom, Diagonals
-        "^": [(0, -1), (0, 1), (-1, 0), (-1, -1), (-1, 1)],  # Top, Left, Right, Diagonals
-        "v": [(0, -1), (0, 1), (1, 0), (1, -1), (1, 1)],    # Bottom, Left, Right, Diagonals
-        "S": [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)],  # All directions
-    }
-
-    # Preprocessing known ship parts
-    for i in range(1, size - 1):
-        for j in range(1, size - 1):
-            cell = originalB[i - 1][j - 1]  # Adjust for padding
-            if cell in directions:
-                for di, dj in directions[cell]:
-                    ni, nj = i + di, j + dj
-                    if 1 <= ni < size - 1 and 1 <= nj < size - 1:  # Stay within bounds
-                        if originalB[ni - 1][nj - 1] == "0":  # Only mark empty cells
-                            originalB[ni - 1][nj - 1] = "."  # Mark as water
-
-    # Convert rows back to strings if needed
-    originalB = ["".join(row) for row in originalB]
-
-    for i in range(0,size):
-        for j in range(0, size):
-            v = None
-            if i == 0 or i == size-1 or j == 0 or j == size-1:
-                v = Variable(str(-1-(i*size+j)), [0])
-            else:
-                ch = originalB[i][j]
-                v = Variable(str(-1-(i*size+j)), [0,1])
-                if ch != "0":
-                    given.append((i,j,ch))
-
-            varlist.append(v)
-            varn[str(-1-(i*size+j))] = v
-
-    ii = 0
-    for i in board.split()[3:]:
-        jj = 0
-        for j in i:
-            if j != '0' and j != '.': # must be ship parts
-                conslist.append(TableConstraint('boolean_match', [varn[str(-1-(ii*size+jj))]], [[1]]))
-            elif j == '.':
-                conslist.append(TableConstraint('boolean_match', [varn[str(-1-(ii*size+jj))]], [[0]]))
-            jj += 1
-        ii += 1
-
-
-    for row in range(0,size):
-        conslist.append(NValuesConstraint('row', [varn[str(-1-(row*size+col))] for col in range(0,size)], [1], row_constraint[row], row_constraint[row]))
-
-    # print(col_constraint)
-    for col in range(0,size):
-        conslist.append(NValuesConstraint('col', [varn[str(-1-(col+row*size))] for row in range(0,size)], [1], col_constraint[col], col_constraint[col]))
-
-    #diagonal constraints on 1/0 variables
-    for i in range(1, size-1):
-        for j in range(1, size-1):
-            for k in range(9):
-                conslist.append(NValuesConstraint('diag', [varn[str(-1-(i*size+j))], varn[str(-1-((i-1)*size+(j-1)))]], [1], 0, 1))
-                conslist.append(NValuesConstraint('diag', [varn[str(-1-(i*size+j))], varn[str(-1-((i-1)*size+(j+1)))]], [1], 0, 1))
-
-
-    for i in range(0, size):
-        for j in range(0, size):
-            v = Variable(str(i*size+j), ['.', 'S'])
-            varlist.append(v)
-            varn[str(i*size+j)] = v
-            conslist.append(TableConstraint('connect', [varn[str(-1-(i*size+j))], varn[str(i*size+j)]], [[0,'.'],[1,'S']]))
-        
-    csp = CSP('battleship', varlist, conslist)
+    model = BattleshipModel(puzzle.n)
+    model.load(puzzle)
     # t_start = time.time()
-    sols, num_nodes = bt_search('GAC', csp, 'mrv', False, False, piece_constraint, originalB, given, size)
+    sols, num_nodes = model.solve(args.backend, args.varorder, args.valueorder, args.restarts, args.seed,
+                                  timeLimit=args.timeout, nodeLimit=args.nodelimit, decompose=not args.nodecompose,
+                                  probeDepth=args.probe, probeLimit=args.probelimit, trace=args.trace)
+    if model.status in ('timeout', 'cancelled'):
+        print("no solution found: {}".format(model.status))
 
     for i in range(len(sols)):
         # print to file the solution
@@ -149,6 +148,32 @@ if __name__ == "__main__":
         # bring sys.stdout back to normal
         sys.stdout = sys.__stdout__
 
+    if args.memory:
+        report = memory_report(model)
+        print("model: {} variables, {} constraints, {} objects, {} bytes ({:.0f} bytes per cell)".format(
+            report['variables'], report['constraints'], report['objects'], report['bytes'], report['bytesPerCell']))
+
+    if args.stats:
+        print("presolve fixed {} cells, {} left for search".format(model.presolved.fixed, model.presolved.unknown()))
+        if model.regions is not None:
+            print("regions: {} (cells {}), {} enumeration nodes, {} solutions".format(
+                len(model.regions['regions']), model.regions['regions'], model.regions['nodes'], model.regions['count']))
+        elif args.backend == 'SAT' and model.satSolver is not None:
+            solver = model.satSolver
+            print("sat: {} variables, {} decisions, {} conflicts, {} propagations".format(
+                solver.nvars, solver.decisions, solver.conflicts, solver.propagations))
+        else:
+            print("nodes explored: {} (value ordering {})".format(num_nodes, args.valueorder))
+            print("decisions: {}, restarts: {}".format(bt_search.decisions, bt_search.restarts))
+            if args.valueorder == 'lcv':
+                print("lcv trial propagations: {}, cache hits: {}".format(bt_search.lcvTrials, bt_search.lcvCacheHits))
+            if args.probe is not None:
+                print("probes: {}, values pruned: {} in {:.2f}s ({:.1f} per probe second)".format(
+                    bt_search.probes, bt_search.probeFixed, bt_search.probeTime,
+                    bt_search.probeFixed / bt_search.probeTime if bt_search.probeTime else 0.0))
+            print("line cache: {} hits, {} misses ({:.1%} hit rate)".format(
+                line_cache.hits, line_cache.misses, line_cache.hitRate()))
+
 
 
 #   python3 battle.py --inputfile input_medium2.txt --outputfile output_medium2.txt  
@@ -0,0 +1,75 @@
+import sys
+import json
+import random
+import argparse
+from model import grid_glyphs, solve_puzzle
+from generator import place_fleet, _puzzle
+from constraints import parse_counts
+
+
+def default_fleet(n):
+    '''the fleet used for n x n boards when none is given: the classic
+       one up to 14x14, one with 6 and 7 long ships above'''
+    return [4, 3, 2, 1] if n < 15 else [6, 5, 4, 3, 2, 1, 1]
+
+
+def bench_puzzle(n, fleet, hints, rng):
+    '''A puzzle for benchmarking: the fleet placed at random with each
+       cell of the planted solution given as a hint with probability
+       hints. Unlike generate_puzzle this needs no solving, so it scales
+       to big boards, but the puzzle can have several solutions. Returns
+       None if the fleet could not be placed.'''
+    grid = place_fleet(n, fleet, rng)
+    if grid is None:
+        return None
+    glyphs = grid_glyphs(grid)
+    board = [[glyphs[i][j] if rng.random() < hints else '0' for j in range(n)] for i in range(n)]
+    return _puzzle(grid, fleet, board)
+
+
+def bench(sizes, fleet=None, count=3, hints=0.2, backends=('GAC', 'SAT'), timeLimit=60, seed=None):
+    '''Solve count puzzles of each size with each backend, yields one
+       dict per solve: size, backend, status, time, nodes and the cells
+       left to search after presolve.'''
+    rng = random.Random(seed)
+    for n in sizes:
+        puzzles = []
+        while len(puzzles) < count:
+            puzzle = bench_puzzle(n, fleet or default_fleet(n), hints, rng)
+            if puzzle is not None:
+                puzzles.append(puzzle)
+        for backend in backends:
+            for puzzle in puzzles:
+                result = solve_puzzle(puzzle, algo=backend, timeLimit=timeLimit)
+                yield {"size": n, "fleet": puzzle.piece_constraint, "backend": backend, "status": result.status,
+                       "time": result.elapsed, "nodes": result.nodes, "searched": n * n - result.fixed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the solver backends.")
+    parser.add_argument("--sizes", type=str, default="10,15,20,25,30", help="Comma separated board sizes.")
+    parser.add_argument("--fleet", type=str, default=None,
+                        help="The fleet (e.g. 6,5,4,3,2,1,1), by default chosen by size.")
+    parser.add_argument("--count", type=int, default=3, help="The number of puzzles per size.")
+    parser.add_argument("--hints", type=float, default=0.2, help="The fraction of the cells given as hints.")
+    parser.add_argument("--backends", type=str, default="GAC,SAT", help="Comma separated backends to run.")
+    parser.add_argument("--timeout", type=float, default=60, help="Time limit per puzzle, in seconds.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed, for reproducible runs.")
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(',')]
+    fleet = parse_counts(args.fleet) if args.fleet else None
+    summary = dict()
+    for run in bench(sizes, fleet, args.count, args.hints, args.backends.split(','), args.timeout, args.seed):
+        # one JSON line per solve on stdout, the summary table on stderr
+        print(json.dumps(run))
+        sys.stdout.flush()
+        summary.setdefault((run["size"], run["backend"]), []).append(run)
+    sys.stderr.write("{:>5} {:>8} {:>7} {:>10} {:>10}\n".format("size", "backend", "solved", "mean time", "max time"))
+    for ((n, backend), runs) in sorted(summary.items()):
+        times = [run["time"] for run in runs]
+        sys.stderr.write("{:>5} {:>8} {:>7} {:>10.2f} {:>10.2f}\n".format(
+            n, backend, "{}/{}".format(sum(run["status"] == "solved" for run in runs), len(runs)),
+            sum(times) / len(times), max(times)))
+
+#   python3 bench.py --sizes 10,20,30 --backends SAT --count 5 --seed 1
@@ -1,4 +1,5 @@
-from csp import Constraint, Variable
+from csp import Constraint, Variable, interned
+from collections import OrderedDict
 
 
 class TableConstraint(Constraint):
@@ -8,6 +9,8 @@ class TableConstraint(Constraint):
        A table constraint explicitly stores the set of satisfying
        tuples of assignments.'''
 
+    __slots__ = ('satAssignments',)
+
     def __init__(self, name, scope, satisfyingAssignments):
         '''Init by specifying a name and a set variables the constraint is over.
            Along with a list of satisfying assignments.
@@ -15,6 +18,8 @@ class TableConstraint(Constraint):
            the number of variables in the constraints scope.
            If sa is a single satisfying assignment, e.g, sa=satisfyingAssignments[0]
            then sa[i] is the value that will be assigned to the variable scope[i].
+           The table is stored as an interned tuple of tuples, shared by
+           all the constraints with the same table.
 
 
            Example, say you want to specify a constraint alldiff(A,B,C,D) for
@@ -35,7 +40,7 @@ class TableConstraint(Constraint):
 
         Constraint.__init__(self,name, scope)
         self._name = "TableCnstr_" + name
-        self.satAssignments = satisfyingAssignments
+        self.satAssignments = interned(satisfyingAssignments)
 
     def check(self):
         '''check if current variable assignments are in the satisfying set'''
@@ -45,7 +50,7 @@ class TableConstraint(Constraint):
                 assignments.append(v.getValue())
             else:
                 return True
-        return assignments in self.satAssignments
+        return tuple(assignments) in self.satAssignments
 
     def hasSupport(self, var,val):
         '''check if var=val has an extension to an assignment of all variables in
@@ -115,6 +120,77 @@ def findvals_(remainingVars, assignment, finalTestfn, partialTestfn):
     return False
 
 
+class LineCache:
+    '''Bounded LRU cache of NValues line states. A line state is packed
+       into one int (see NValuesConstraint.lineKey): two bits per variable
+       (can take a required value, can take another value) after a
+       leading 1 bit, then the lower and upper bounds. The cached value
+       is what lineSupports computes for it.
+
+       The same states recur all over the search tree and across puzzles
+       of one size, the module level line_cache is shared by every
+       NValuesConstraint of the process (so by every solve of a batch).'''
+    def __init__(self, maxsize=1 << 16):
+        self.maxsize = maxsize
+        self._table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self._table:
+            self.hits += 1
+            self._table.move_to_end(key)
+            return self._table[key]
+        self.misses += 1
+        value = lineSupports(key)
+        self._table[key] = value
+        if len(self._table) > self.maxsize:
+            self._table.popitem(last=False)
+        return value
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self._table.clear()
+        self.hits = 0
+        self.misses = 0
+
+def lineSupports(key):
+    '''Supports of the packed line state key: returns (inMask, outMask),
+       bit k of inMask (outMask) set when variable k of the line can take
+       a required (another) value in an assignment meeting the bounds.
+       Both are 0 when the line can't meet them.'''
+    ub = key & 0xffff
+    lb = (key >> 16) & 0xffff
+    cells = key >> 32
+    states = []
+    while cells > 1:
+        states.append(cells & 3)
+        cells >>= 2
+    states.reverse()
+    forced = states.count(1)
+    free = states.count(3)
+    if 0 in states or max(lb, forced) > min(ub, forced + free):
+        return (0, 0)
+    inMask = 0
+    outMask = 0
+    for (k, st) in enumerate(states):
+        if st == 3:
+            if forced + 1 <= ub and forced + free >= lb:
+                inMask |= 1 << k
+            if forced <= ub and forced + free - 1 >= lb:
+                outMask |= 1 << k
+        elif st == 1:
+            inMask |= 1 << k
+        else:
+            outMask |= 1 << k
+    return (inMask, outMask)
+
+line_cache = LineCache()
+
+
 class NValuesConstraint(Constraint):
     '''NValues constraint over a set of variables.  Among the variables in
        the constraint's scope the number that have been assigned
@@ -129,15 +205,39 @@ class NValuesConstraint(Constraint):
        the V1, V2, V3, V4 are assigned the value 1 or 4, and at most 3
        of them have been assigned the value 1 or 4.
 
+       Supports are looked up in line_cache once per revision of the
+       constraint, by supports().
     '''
 
+    __slots__ = ('_required', '_lb', '_ub', '_pos', '_masks')
+
     def __init__(self, name, scope, required_values, lower_bound, upper_bound):
         Constraint.__init__(self,name, scope)
         self._name = "NValues_" + name
-        self._required = required_values
+        self._required = interned(required_values)
+        self._lb = lower_bound
+        self._ub = upper_bound
+        self._pos = dict((v, k) for (k, v) in enumerate(self._scope))
+        self._masks = (0, 0)
+
+    def bounds(self):
+        return (self._lb, self._ub)
+
+    def setBounds(self, lower_bound, upper_bound):
+        '''change the bounds in place (used to reuse a constraint for a new problem)'''
         self._lb = lower_bound
         self._ub = upper_bound
 
+    def lineKey(self):
+        '''the current state of the constraint packed for line_cache'''
+        cells = 1
+        for v in self.scope():
+            st = 0
+            for val in v.curDomain():
+                st |= 1 if val in self._required else 2
+            cells = (cells << 2) | st
+        return (((cells << 16) | self._lb) << 16) | self._ub
+
     def check(self):
         assignments = []
         for v in self.scope():
@@ -158,38 +258,35 @@ class NValuesConstraint(Constraint):
 
         return self._lb <= rv_count and self._ub >= rv_count
 
+    def supports(self):
+        '''look up the supports of the current line state in line_cache,
+           for hasSupport to test. Only the number of variables that can
+           (or must) take a required value matters, so the answer for
+           the whole line is computed once per line state.
+
+           GacEnforce calls it when it starts revising the constraint:
+           the values it prunes had no support, so pruning them leaves
+           the supports of the others unchanged.'''
+        self._masks = line_cache.get(self.lineKey())
+        return self._masks
+
     def hasSupport(self, var, val):
         '''check if var=val has an extension to an assignment of the
-           other variable in the constraint that satisfies the constraint
-
-           HINT: check the implementation of AllDiffConstraint.hasSupport
-                 a similar approach is applicable here (but of course
-                 there are other ways as well)
+           other variable in the constraint that satisfies the constraint,
+           in the line state of the last call to supports()
         '''
-        if var not in self.scope():
+        k = self._pos.get(var)
+        if k is None:
             return True   #var=val has support on any constraint it does not participate in
-
-        #define the test functions for findvals
-        def valsOK(l):
-            '''tests a list of assignments which are pairs (var,val)
-               to see if they can satisfy this sum constraint'''
-            rv_count = 0
-            vals = [val for (var, val) in l]
-            for v in vals:
-                if v in self._required:
-                    rv_count += 1
-            least = rv_count + self.arity() - len(vals)
-            most =  rv_count
-            return self._lb <= least and self._ub >= most
-        varsToAssign = self.scope()
-        varsToAssign.remove(var)
-        x = findvals(varsToAssign, [(var, val)], valsOK, valsOK)
-        return x
+        mask = self._masks[0] if val in self._required else self._masks[1]
+        return bool(mask >> k & 1)
 
 class IfAllThenOneConstraint(Constraint):
     '''if each variable in left_side equals each value in left_values 
     then one of the variables in right side has to equal one of the values in right_values. 
     hasSupport tested only, check() untested.'''
+    __slots__ = ('_ls', '_rs', '_lv', '_rv')
+
     def __init__(self, name, left_side, right_side, left_values, right_values):
         Constraint.__init__(self,name, left_side+right_side)
         self._name = "IfAllThenOne_" + name
@@ -200,3 +297,200 @@ class IfAllThenOneConstraint(Constraint):
 
 
 
+
+def parse_counts(spec):
+    '''Parse a list of counts of the input format: a string of digits
+       ("43210") or, when some count is over 9, of comma separated
+       numbers ("4,3,2,1,0,1,1" or "12,9,10"). Used for the row/column
+       sums and the fleet (fleet[L-1] ships of length L, any number of
+       lengths). Raises ValueError if spec is neither.'''
+    if ',' in spec:
+        parts = [x for x in spec.split(',') if x != '']
+    else:
+        parts = list(spec)
+    if not parts or not all(x.isdigit() for x in parts):
+        raise ValueError("malformed counts {!r}".format(spec))
+    return [int(x) for x in parts]
+
+def format_counts(counts):
+    '''inverse of parse_counts, digits unless some count is over 9'''
+    if any(c > 9 for c in counts):
+        return ",".join(str(c) for c in counts)
+    return "".join(str(c) for c in counts)
+
+_fleet_lines = dict()
+
+def fleet_lines(size):
+    '''Ship placements of a padded board of width size, for use with
+       fleet_deductions. Returns a dict mapping each ship length L to
+       a list of lines (rows, and for L > 1 also columns), each line
+       being the list of the placements (start, body, ring) of length L
+       in it sorted by start. body and ring are tuples of cell indices
+       i*size+j of the ship cells and of the cells around them.
+
+       The result is computed once per size and shared by all callers,
+       it must not be modified.'''
+    if size in _fleet_lines:
+        return _fleet_lines[size]
+    lines = dict()
+    for L in range(1, size-1):
+        lines[L] = []
+        for horizontal in ([True] if L == 1 else [True, False]):
+            for a in range(1, size-1):
+                line = []
+                for start in range(1, size-L):
+                    if horizontal:
+                        cells = [(a, start+k) for k in range(L)]
+                    else:
+                        cells = [(start+k, a) for k in range(L)]
+                    ring = set()
+                    for (i, j) in cells:
+                        for di in (-1, 0, 1):
+                            for dj in (-1, 0, 1):
+                                ring.add((i+di, j+dj))
+                    ring.difference_update(cells)
+                    line.append((start, tuple(i*size+j for (i, j) in cells),
+                                 tuple(sorted(i*size+j for (i, j) in ring))))
+                lines[L].append(line)
+    _fleet_lines[size] = lines
+    return lines
+
+def analyse_fleet(lines, fleet, can0, can1):
+    '''can0[k]/can1[k] tell if cell k can still be water/ship. A
+       placement is possible if its body can be ship and its ring
+       water, and fixed if that is already decided.
+
+       return (fixed, capacity, usable): the number of fixed ships and an
+       upper bound on the ships that fit (greedily packing the possible
+       placements of each line) per length, and the list of
+       (L, body, ring, isFixed) of the possible placements of the
+       lengths in the fleet'''
+    fixed = [0] * (len(fleet) + 1)
+    capacity = [0] * (len(fleet) + 1)
+    usable = []
+    for L in range(1, len(fleet) + 1):
+        if fleet[L-1] == 0 or L not in lines:
+            continue
+        for line in lines[L]:
+            last = -2
+            for (start, body, ring) in line:
+                if not all(can1[k] for k in body) or not all(can0[k] for k in ring):
+                    continue
+                isFixed = not any(can0[k] for k in body) and not any(can1[k] for k in ring)
+                if isFixed:
+                    fixed[L] += 1
+                usable.append((L, body, ring, isFixed))
+                if start >= last + 2:
+                    capacity[L] += 1
+                    last = start + L - 1
+    return fixed, capacity, usable
+
+def fleet_deductions(lines, fleet, can0, can1, cells):
+    '''What the fleet implies for the cells (indices) in cells:
+       returns None if the fleet can no longer be placed, else the sets
+       (must0, must1) of cells that have to be water/ship:
+
+         - when there are exactly as many possible placements of a
+           length left as ships of that length missing, all of them
+           are ships,
+         - a cell that no usable placement covers is water.'''
+    fixed, capacity, usable = analyse_fleet(lines, fleet, can0, can1)
+    must0 = set()
+    must1 = set()
+    covered = set()
+    for L in range(1, len(fleet) + 1):
+        needed = fleet[L-1] - fixed[L]
+        if needed < 0 or capacity[L] < fleet[L-1]:
+            return None
+        candidates = [(body, ring) for (l, body, ring, isFixed) in usable if l == L and not isFixed]
+        if needed > 0 and len(candidates) == needed:
+            for (body, ring) in candidates:
+                must1.update(body)
+                must0.update(ring)
+    for (L, body, ring, isFixed) in usable:
+        if isFixed or fleet[L-1] > fixed[L]:
+            covered.update(body)
+    for k in cells:
+        if can1[k] and k not in covered:
+            must0.add(k)
+    return must0, must1
+
+
+class FleetConstraint(Constraint):
+    '''Global fleet constraint of the battleship CSP. grid is the list of
+       rows of 0/1 cell variables of the padded board (border cells
+       have domain [0]) and fleet[L-1] is the number of ships of length L.
+
+       From the current domains propagate computes, for every length,
+       the ships already fixed and an upper bound on the ships that
+       still fit, fails if too many ships are fixed or too few still
+       fit, and prunes the fleet_deductions.
+
+       Being global it is not checked value by value with hasSupport by
+       GacEnforce, which calls propagate once the other constraints
+       have reached their fixpoint.'''
+    __slots__ = ('_cells', '_index', '_scopeIndex', '_fleet', '_lines')
+
+    def __init__(self, name, grid, fleet):
+        size = len(grid)
+        scope = [grid[i][j] for i in range(1, size-1) for j in range(1, size-1)]
+        Constraint.__init__(self, name, scope)
+        self._name = "Fleet_" + name
+        self._cells = [v for row in grid for v in row]
+        self._index = dict((v, k) for k, v in enumerate(self._cells))
+        self._scopeIndex = [self._index[v] for v in scope]
+        self._fleet = list(fleet)
+        self._lines = fleet_lines(size)
+
+    def setFleet(self, fleet):
+        '''change the fleet in place (used to reuse the constraint for a new problem)'''
+        self._fleet = list(fleet)
+
+    def _state(self):
+        can0 = [v.inCurDomain(0) for v in self._cells]
+        can1 = [v.inCurDomain(1) for v in self._cells]
+        return can0, can1
+
+    def check(self):
+        for v in self.scope():
+            if not v.isAssigned():
+                return True
+        can0, can1 = self._state()
+        fixed, capacity, usable = analyse_fleet(self._lines, self._fleet, can0, can1)
+        for L in range(1, len(self._fleet) + 1):
+            if fixed[L] != self._fleet[L-1]:
+                return False
+        #every ship cell must be part of one of the counted ships
+        return sum(L * fixed[L] for L in range(len(fixed))) == sum(can1[k] for k in self._scopeIndex)
+
+    def hasSupport(self, var, val):
+        '''only a necessary condition: var=val leaves room for the fleet'''
+        if var not in self._index:
+            return True
+        can0, can1 = self._state()
+        k = self._index[var]
+        can0[k] = val == 0
+        can1[k] = val == 1
+        return fleet_deductions(self._lines, self._fleet, can0, can1, []) is not None
+
+    def propagate(self, reasonVar, reasonVal):
+        '''prune what the fleet implies, recording reasonVar=reasonVal as
+           the reason. Return the list of variables pruned, or None if a
+           domain was wiped out'''
+        can0, can1 = self._state()
+        deductions = fleet_deductions(self._lines, self._fleet, can0, can1, self._scopeIndex)
+        if deductions is None:
+            return None
+        must0, must1 = deductions
+
+        pruned = []
+        for (ks, val) in ((must1, 0), (must0, 1)):
+            for k in ks:
+                var = self._cells[k]
+                if not var.inCurDomain(val):
+                    continue
+                if var.isAssigned() or var.curDomainSize() == 1:
+                    return None #DWO
+                var.pruneValue(val, reasonVar, reasonVal)
+                pruned.append(var)
+        return pruned
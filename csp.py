@@ -1,5 +1,15 @@
 import sys
 
+_interned = dict()
+
+def interned(values):
+    '''Return values (a list of values or of lists of values, e.g. a
+       domain or the table of a TableConstraint) as an immutable tuple
+       (of tuples), the same object for all equal values, so identical
+       domains and tables are stored once.'''
+    values = tuple(tuple(v) if isinstance(v, list) else v for v in values)
+    return _interned.setdefault(values, values)
+
 class Variable:
     '''Class for defining CSP variables.
 
@@ -12,7 +22,11 @@ class Variable:
       domain for the variable. Values pruned from the variable domain
       are removed from the current domain but not from the original
       domain. Values can be also restored.
+
+      The (original) domain is an interned tuple shared with the other
+      variables with the same domain.
     '''
+    __slots__ = ('_name', '_dom', '_curdom', '_value')
 
     undoDict = dict()             #stores pruned values indexed by a
                                         #(variable,value) reason pair
@@ -21,7 +35,7 @@ class Variable:
         string) and domain of values.
         '''
         self._name = name                #text name for variable
-        self._dom = list(domain)         #Make a copy of passed domain
+        self._dom = interned(domain)     #Shared copy of passed domain
         self._curdom = list(domain)      #using list
         self._value = None
 
@@ -38,7 +52,7 @@ class Variable:
 
     def resetDomain(self, newdomain):
         '''reset the domain of this variable'''
-        self._dom = newdomain
+        self._dom = interned(newdomain)
 
     def getValue(self):
         return self._value
@@ -103,7 +117,7 @@ class Variable:
 
     @staticmethod
     def clearUndoDict():
-        undoDict = dict()
+        Variable.undoDict.clear()
 
     @staticmethod
     def restoreValues(reasonVar, reasonVal):
@@ -132,11 +146,13 @@ class Constraint:
        the constraint greaterThan(V1,V2) is not the same as the
        contraint greaterThan(V2,V1).
     '''
+    __slots__ = ('_scope', '_name')
+
     def __init__(self, name, scope):
         '''create a constraint object, specify the constraint name (a
         string) and its scope (an ORDERED list of variable
         objects).'''
-        self._scope = list(scope)
+        self._scope = tuple(scope)
         self._name = "baseClass_" + name  #override in subconstraint types!
 
     def scope(self):
@@ -194,10 +210,11 @@ class CSP:
             if v not in variables:
                 print("Error: variable {} appears in constraint but specified as one of the variables of the CSP {}".format(v.name(), self.name()))
 
+        self._var_index = {v: i for i, v in enumerate(variables)}
         self.constraints_of = [[] for i in range(len(variables))]
         for c in constraints:
             for v in c.scope():
-                i = variables.index(v)
+                i = self._var_index[v]
                 self.constraints_of[i].append(c)
 
     def name(self):
@@ -212,7 +229,7 @@ class CSP:
     def constraintsOf(self, var):
         '''return constraints with var in their scope'''
         try:
-            i = self.variables().index(var)
+            i = self._var_index[var]
             return list(self.constraints_of[i])
         except:
             print("Error: tried to find constraint of variable {} that isn't in this CSP {}".format(var, self.name()))
@@ -228,21 +245,23 @@ class CSP:
            erroneous solutions'''
 
         #save values to restore later
-        current_values = [(var, var.getValue()) for var in self.variables()]
+        current_values = [(var, var.getValue()) for var in self._variables]
         errs = []
+        allVars = set(self._variables)
 
         for s in solutions:
             s_vars = [var for (var, val) in s]
 
-            if len(s_vars) != len(self.variables()):
+            if len(s_vars) != len(allVars):
                 errs.append([s, "Solution has incorrect number of variables in it"])
                 continue
 
-            if len(set(s_vars)) != len(self.variables()):
+            s_set = set(s_vars)
+            if len(s_set) != len(allVars):
                 errs.append([s, "Solution has duplicate variable assignments"])
                 continue
 
-            if set(s_vars) != set(self.variables()):
+            if s_set != allVars:
                 errs.append([s, "Solution has incorrect variable in it"])
                 continue
 
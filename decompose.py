@@ -0,0 +1,359 @@
+from backtracking import SearchTimeout
+
+
+class RegionTooBig(Exception):
+    '''Raised by enumerate_region when a region has more fills than it
+       may enumerate'''
+    pass
+
+
+class Region:
+    '''A set of undecided cells that no constraint links to the cells of
+       any other region, except for the fleet count and the sums of the
+       rows and columns they share.
+
+       cells are the (i, j) of the undecided cells, ships the (i, j) of the
+       decided ship cells whose ships reach into the region, rows/cols map
+       each row/column of the region to the number of ships the
+       undecided cells of the whole line must still hold, spare maps each
+       of these lines, ('r', i) or ('c', j), to its undecided cells
+       outside the region and middles are the (i, j) of the 'M' hints
+       among ships.'''
+    def __init__(self, cells, ships, rows, cols, middles, spare):
+        self.cells = cells
+        self.ships = ships
+        self.rows = rows
+        self.cols = cols
+        self.middles = middles
+        self.spare = spare
+
+    def key(self):
+        '''the region up to translation (used to memoise enumerate_region)'''
+        i0 = min(i for (i, j) in self.cells + self.ships)
+        j0 = min(j for (i, j) in self.cells + self.ships)
+        rel = lambda cells: tuple(sorted((i-i0, j-j0) for (i, j) in cells))
+        return (rel(self.cells), rel(self.ships), rel(self.middles),
+                tuple(sorted((i-i0, k) for (i, k) in self.rows.items())),
+                tuple(sorted((j-j0, k) for (j, k) in self.cols.items())),
+                tuple(sorted(((r, k-(i0 if r == 'r' else j0)), m) for ((r, k), m) in self.spare.items())))
+
+
+def ship_segments(ship):
+    '''lengths of the ships formed by the set ship of (i, j) ship cells'''
+    lengths = []
+    for (i, j) in ship:
+        if (i-1, j) in ship or (i, j-1) in ship:
+            continue
+        L = 1
+        if (i+1, j) in ship:
+            while (i+L, j) in ship:
+                L += 1
+        else:
+            while (i, j+L) in ship:
+                L += 1
+        lengths.append(L)
+    return lengths
+
+def find_regions(puzzle, grid):
+    '''Split the undecided (None) cells of the padded presolve grid of
+       puzzle into regions. Two undecided cells are linked when they
+       touch, also diagonally, each other or a common ship cell (ships
+       can't touch and a ship's length depends on all its cells). Regions
+       may share rows and columns, join_regions then splits their sums.
+
+       Returns (regions, fixed): the list of Regions and the lengths of
+       the ships made only of decided cells.'''
+    size = len(grid)
+    parent = dict()
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    def union(a, b):
+        parent[find(a)] = find(b)
+
+    nodes = [(i, j) for i in range(1, size-1) for j in range(1, size-1) if grid[i][j] != 0]
+    for c in nodes:
+        parent[c] = c
+    for (i, j) in nodes:
+        for (di, dj) in [(0, 1), (1, -1), (1, 0), (1, 1)]:
+            if (i+di, j+dj) in parent:
+                union((i, j), (i+di, j+dj))
+
+    groups = dict()
+    for c in nodes:
+        groups.setdefault(find(c), []).append(c)
+    undecided = dict()
+    for i in range(1, size-1):
+        for j in range(1, size-1):
+            if grid[i][j] is None:
+                undecided[('r', i)] = undecided.get(('r', i), 0) + 1
+                undecided[('c', j)] = undecided.get(('c', j), 0) + 1
+    regions = []
+    fixed = []
+    for group in groups.values():
+        cells = [(i, j) for (i, j) in group if grid[i][j] is None]
+        ships = [(i, j) for (i, j) in group if grid[i][j] == 1]
+        if not cells:
+            fixed += ship_segments(set(ships))
+            continue
+        rows = dict()
+        cols = dict()
+        for (i, j) in cells:
+            rows[i] = puzzle.row_constraint[i-1] - grid[i].count(1)
+            cols[j] = puzzle.col_constraint[j-1] - [grid[k][j] for k in range(size)].count(1)
+        middles = [(i, j) for (i, j) in ships if puzzle.board[i-1][j-1] == 'M']
+        spare = dict((line, undecided[line]) for line in [('r', i) for i in rows] + [('c', j) for j in cols])
+        for (i, j) in cells:
+            spare[('r', i)] -= 1
+            spare[('c', j)] -= 1
+        regions.append(Region(cells, ships, rows, cols, middles, spare))
+    return regions, fixed
+
+def region_lines(region):
+    '''the rows ('r', i) and then the columns ('c', j) of region, sorted'''
+    return [('r', i) for i in sorted(region.rows)] + [('c', j) for j in sorted(region.cols)]
+
+def enumerate_region(region, fleet, solutionLimit=None, budget=None, nodes=None, maxNodes=None):
+    '''Every way to fill the cells of region, grouped by fleet usage and
+       by the ship cells put in each line of the region.
+
+       Returns a dict mapping each (usage, lines) to [count, fills]:
+       usage is the tuple of the number of ships of each length
+       1..len(fleet) in the region, lines the number of ship cells the
+       fill puts in each of region_lines(region), count the number of
+       fills with that usage and lines and fills the first solutionLimit
+       (all if None) of them, each a tuple of the 0/1 values of
+       region.cells. nodes is a one element list counting the nodes of
+       the enumeration, checked against budget; RegionTooBig is raised
+       past maxNodes of them.'''
+    cells = sorted(region.cells)
+    ship = set(region.ships)
+    maxlen = max([L for L in range(1, len(fleet)+1) if fleet[L-1]] or [0])
+    lines = region_lines(region)
+    #the other regions of a line may hold the rest of its ships, at most
+    #one per undecided cell
+    need = dict()
+    left = dict(region.spare)
+    for (i, j) in cells:
+        for line in (('r', i), ('c', j)):
+            left[line] += 1
+    for (i, k) in region.rows.items():
+        need[('r', i)] = k
+    for (j, k) in region.cols.items():
+        need[('c', j)] = k
+    total = dict(need)
+    usages = dict()
+    fill = []
+    if nodes is None:
+        nodes = [0]
+
+    def run(i, j, di, dj):
+        L = 1
+        while (i+L*di, j+L*dj) in ship:
+            L += 1
+        return L
+
+    def leaf():
+        for (i, j) in region.middles:
+            if not ((i-1, j) in ship and (i+1, j) in ship) and not ((i, j-1) in ship and (i, j+1) in ship):
+                return
+        usage = [0] * len(fleet)
+        for L in ship_segments(ship):
+            if L > len(fleet):
+                return
+            usage[L-1] += 1
+            if usage[L-1] > fleet[L-1]:
+                return
+        key = (tuple(usage), tuple(total[line] - need[line] for line in lines))
+        entry = usages.setdefault(key, [0, []])
+        entry[0] += 1
+        if solutionLimit is None or len(entry[1]) < solutionLimit:
+            entry[1].append(tuple(fill))
+
+    def search(k):
+        nodes[0] += 1
+        if budget is not None:
+            budget.check(nodes[0], 0)
+        if maxNodes is not None and nodes[0] > maxNodes:
+            raise RegionTooBig()
+        if k == len(cells):
+            leaf()
+            return
+        (i, j) = cells[k]
+        r, c = ('r', i), ('c', j)
+        left[r] -= 1
+        left[c] -= 1
+        for val in (0, 1):
+            if val == 1:
+                if need[r] == 0 or need[c] == 0:
+                    continue
+                if any((i+di, j+dj) in ship for (di, dj) in [(-1, -1), (-1, 1), (1, -1), (1, 1)]):
+                    continue
+                if run(i, j, 0, -1) + run(i, j, 0, 1) - 1 > maxlen or run(i, j, -1, 0) + run(i, j, 1, 0) - 1 > maxlen:
+                    continue
+                need[r] -= 1
+                need[c] -= 1
+                ship.add((i, j))
+            elif need[r] > left[r] or need[c] > left[c]:
+                continue
+            fill.append(val)
+            search(k+1)
+            fill.pop()
+            if val == 1:
+                ship.discard((i, j))
+                need[r] += 1
+                need[c] += 1
+        left[r] += 1
+        left[c] += 1
+
+    search(0)
+    return usages
+
+def join_regions(regions, tables, fleet, fixed, needs, maxLinks=None, comboLimit=None, budget=None, nodes=0):
+    '''Knapsack over the fleet vector and the line sums: tables are the
+       enumerate_region results of the regions, fixed the lengths of the
+       ships outside them and needs maps every line with undecided cells
+       to the ship cells they must still hold, to be split between the
+       regions crossing it. Returns (count, combos): the number of
+       solutions and the list of the (usage, lines) keys (one per
+       region) of each combination that uses up exactly the fleet and
+       the line sums (the first comboLimit ones, all if None).
+       RegionTooBig is raised when a step links more than maxLinks
+       (state, key) pairs; budget is checked once per state.'''
+    base = [0] * len(fleet)
+    for L in fixed:
+        if L > len(fleet):
+            return 0, []
+        base[L-1] += 1
+    if any(base[k] > fleet[k] for k in range(len(fleet))):
+        return 0, []
+    order = sorted(needs)
+    index = dict((line, k) for (k, line) in enumerate(order))
+    limit = tuple(needs[line] for line in order)
+    # states[t] maps each (fleet vector, line vector) reachable with the
+    # first t regions to its number of solutions and the (previous state,
+    # key) leading to it
+    states = [{(tuple(base), (0,) * len(order)): [1, []]}]
+    for (region, table) in zip(regions, tables):
+        at = [index[line] for line in region_lines(region)]
+        nxt = dict()
+        links = 0
+        for (state, (count, _)) in states[-1].items():
+            if budget is not None:
+                budget.check(nodes, 0)
+            vec, sums = state
+            for (key, (n, _)) in table.items():
+                usage, lines = key
+                total = tuple(a + b for (a, b) in zip(vec, usage))
+                if any(total[k] > fleet[k] for k in range(len(fleet))):
+                    continue
+                added = list(sums)
+                for (k, m) in zip(at, lines):
+                    added[k] += m
+                if any(added[k] > limit[k] for k in at):
+                    continue
+                entry = nxt.setdefault((total, tuple(added)), [0, []])
+                entry[0] += count * n
+                entry[1].append((state, key))
+                links += 1
+            if maxLinks is not None and links > maxLinks:
+                raise RegionTooBig()
+        states.append(nxt)
+
+    goal = (tuple(fleet), limit)
+    if goal not in states[-1]:
+        return 0, []
+    combos = []
+    def back(t, state, suffix):
+        if t == 0:
+            combos.append(suffix)
+            return
+        for (prev, key) in states[t][state][1]:
+            if comboLimit is not None and len(combos) >= comboLimit:
+                return
+            back(t-1, prev, [key] + suffix)
+    back(len(tables), goal, [])
+    return states[-1][goal][0], combos
+
+_tables = dict()
+
+def solve_regions(puzzle, grid, solutionLimit=1, budget=None, maxCells=40, maxNodes=50000, maxLinks=100000):
+    '''Solve the puzzle from the padded presolve grid region by region:
+       each region's fills are enumerated on their own (memoised across
+       calls on the region's shape) and joined over the fleet and the
+       row/column sums, so the cost is the sum of the regions' instead
+       of their product.
+
+       Returns None when decomposing does not pay off (a single region,
+       one with more than maxCells cells, enumerations taking more than
+       maxNodes nodes or join steps linking more than maxLinks pairs),
+       else (grids, info): the solved padded grids (up to
+       solutionLimit, None for all) and a dict with status
+       ('solved', 'unsat', 'timeout' or 'cancelled'), the number of
+       solutions count, regions (their sizes) and nodes.'''
+    regions, fixed = find_regions(puzzle, grid)
+    if len(regions) < 2 or max(len(r.cells) for r in regions) > maxCells:
+        return None
+    fleet = puzzle.fleet
+    info = {'regions': [len(r.cells) for r in regions], 'nodes': 0, 'count': 0}
+
+    nodes = [0]
+    tables = []
+    try:
+        for region in regions:
+            key = (region.key(), tuple(fleet), solutionLimit)
+            if key not in _tables:
+                if len(_tables) > 10000:
+                    _tables.clear()
+                _tables[key] = enumerate_region(region, fleet, solutionLimit, budget, nodes, maxNodes)
+            tables.append(_tables[key])
+    except RegionTooBig:
+        return None
+    except SearchTimeout as e:
+        info['status'] = e.status
+        info['nodes'] = nodes[0]
+        return [], info
+    info['nodes'] = nodes[0]
+
+    needs = dict()
+    for region in regions:
+        needs.update((('r', i), k) for (i, k) in region.rows.items())
+        needs.update((('c', j), k) for (j, k) in region.cols.items())
+    try:
+        count, combos = join_regions(regions, tables, fleet, fixed, needs, maxLinks, solutionLimit, budget, nodes[0])
+    except RegionTooBig:
+        return None
+    except SearchTimeout as e:
+        info['status'] = e.status
+        return [], info
+    info['count'] = count
+    info['status'] = 'solved' if count else 'unsat'
+    grids = []
+    try:
+        for combo in combos:
+            # every combination of the stored fills of its keys
+            partials = [[row[:] for row in grid]]
+            for (region, table, key) in zip(regions, tables, combo):
+                cells = sorted(region.cells)
+                extended = []
+                for g in partials:
+                    if budget is not None:
+                        budget.check(nodes[0], 0)
+                    for fill in table[key][1]:
+                        g2 = [row[:] for row in g]
+                        for ((i, j), val) in zip(cells, fill):
+                            g2[i][j] = val
+                        extended.append(g2)
+                        if solutionLimit is not None and len(extended) >= solutionLimit:
+                            break
+                    if solutionLimit is not None and len(extended) >= solutionLimit:
+                        break
+                partials = extended
+            grids += partials
+            if solutionLimit is not None and len(grids) >= solutionLimit:
+                return grids[:solutionLimit], info
+    except SearchTimeout as e:
+        info['status'] = e.status
+    return grids, info
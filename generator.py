@@ -0,0 +1,154 @@
+import sys
+import json
+import random
+import argparse
+import multiprocessing
+from model import Puzzle, BattleshipModel, grid_glyphs, warm_model
+from constraints import parse_counts
+
+
+def place_fleet(n, fleet, rng, tries=1000):
+    '''Place the fleet (fleet[L-1] ships of length L) at random on an n x n
+       board, no two ships touching, not even diagonally. Returns the
+       padded grid of 1 (ship) / 0 (water), or None if tries random
+       attempts all got stuck.'''
+    size = n + 2
+    ships = [L for L in range(len(fleet), 0, -1) for k in range(fleet[L-1])]
+    for attempt in range(tries):
+        grid = [[0] * size for i in range(size)]
+        for L in ships:
+            spots = []
+            for horizontal in ([True] if L == 1 else [True, False]):
+                for i in range(1, size - 1 - (0 if horizontal else L - 1)):
+                    for j in range(1, size - 1 - (L - 1 if horizontal else 0)):
+                        cells = [(i, j + k) if horizontal else (i + k, j) for k in range(L)]
+                        if all(grid[a + da][b + db] == 0 for (a, b) in cells
+                               for da in (-1, 0, 1) for db in (-1, 0, 1)):
+                            spots.append(cells)
+            if not spots:
+                break
+            for (a, b) in rng.choice(spots):
+                grid[a][b] = 1
+        else:
+            return grid
+    return None
+
+
+def _puzzle(grid, piece_constraint, board):
+    n = len(grid) - 2
+    rows = [sum(grid[i][1:-1]) for i in range(1, n + 1)]
+    cols = [sum(grid[i][j] for i in range(1, n + 1)) for j in range(1, n + 1)]
+    return Puzzle(rows, cols, piece_constraint, ["".join(row) for row in board])
+
+
+def generate_puzzle(n, piece_constraint, rng, backend='SAT'):
+    '''Generate a puzzle with a unique solution: place the fleet at random,
+       then add hints (taken from the planted solution where the solver
+       finds a second solution differing from it) until the solver,
+       counting up to 2 solutions, confirms the solution is unique, and
+       finally drop every hint that is not needed for that.
+
+       piece_constraint is the fleet, a list of counts or a parse_counts
+       string. Returns (puzzle, metrics) or None if the fleet could not
+       be placed.'''
+    fleet = parse_counts(piece_constraint) if isinstance(piece_constraint, str) else list(piece_constraint)
+    grid = place_fleet(n, fleet, rng)
+    if grid is None:
+        return None
+    glyphs = grid_glyphs(grid)
+    model = warm_model(n)
+    board = [['0'] * n for i in range(n)]
+
+    def solutions():
+        model.load(_puzzle(grid, fleet, board))
+        sols, nodes = model.solve(backend, solutionLimit=2)
+        return [model.solutionGrid(sol) for sol in sols]
+
+    hints = []
+    sols = solutions()
+    while len(sols) != 1:
+        other = sols[0] if sols[0] != grid else sols[1]
+        diff = [(i, j) for i in range(1, n + 1) for j in range(1, n + 1) if other[i][j] != grid[i][j]]
+        (i, j) = rng.choice(diff)
+        board[i-1][j-1] = glyphs[i-1][j-1]
+        hints.append((i, j))
+        sols = solutions()
+
+    rng.shuffle(hints)
+    for (i, j) in list(hints):
+        board[i-1][j-1] = '0'
+        if len(solutions()) != 1:
+            board[i-1][j-1] = glyphs[i-1][j-1]
+        else:
+            hints.remove((i, j))
+
+    puzzle = _puzzle(grid, fleet, board)
+    model.load(puzzle)
+    sols, nodes = model.solve(backend, solutionLimit=2)
+    free = n * n - len(hints)
+    metrics = {
+        "size": n,
+        "hints": len(hints),
+        "backend": backend,
+        "nodes": nodes,
+        "presolveFixed": float(model.presolved.fixed) / free if free else 1.0,
+    }
+    return puzzle, metrics
+
+
+def _generate(task):
+    '''pool worker: keep trying seeds derived from the task's until a
+       puzzle comes out'''
+    (n, piece_constraint, seed, backend) = task
+    rng = random.Random(seed)
+    while True:
+        result = generate_puzzle(n, piece_constraint, rng, backend)
+        if result is not None:
+            return str(result[0]), result[1]
+
+
+def generate(n, piece_constraint, count, seed=None, workers=1, backend='SAT'):
+    '''generate count puzzles over a pool of workers processes (each
+       keeping a warm model), yields (puzzle text, metrics) in order'''
+    master = random.Random(seed)
+    tasks = [(n, piece_constraint, master.getrandbits(64), backend) for k in range(count)]
+    if workers <= 1:
+        for task in tasks:
+            yield _generate(task)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for result in pool.imap(_generate, tasks):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, required=True, help="The board size.")
+    parser.add_argument("--fleet", type=str, required=True,
+                        help="The fleet, number of ships of length 1, 2, 3, ... (e.g. 43210, or 6,5,4,3,2,1,1).")
+    parser.add_argument("--count", type=int, default=1, help="The number of puzzles to generate.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed, for reproducible puzzles.")
+    parser.add_argument("--workers", type=int, default=1, help="The number of worker processes.")
+    parser.add_argument("--backend", choices=['GAC', 'SAT'], default='SAT',
+                        help="The solver used to check uniqueness.")
+    parser.add_argument("--outdir", type=str, default=None,
+                        help="Write the puzzles to <outdir>/input_gen<k>.txt instead of stdout.")
+    args = parser.parse_args()
+
+    for k, (text, metrics) in enumerate(generate(args.size, args.fleet, args.count, args.seed, args.workers, args.backend)):
+        if args.outdir is None:
+            if k > 0:
+                print("")
+            print(text)
+        else:
+            metrics["file"] = "{}/input_gen{}.txt".format(args.outdir, k + 1)
+            file = open(metrics["file"], 'w')
+            file.write(text + "\n")
+            file.close()
+        # metrics go to stderr so that stdout stays a stream of puzzles
+        sys.stderr.write(json.dumps(metrics) + "\n")
+        sys.stdout.flush()
@@ -0,0 +1,402 @@
+from csp import Constraint, Variable, CSP
+from constraints import *
+from backtracking import *
+from presolve import presolve, _glyphs
+from sat import sat_solve
+from decompose import solve_regions
+from searchtrace import TraceWriter
+import time
+import sys
+
+
+class Puzzle:
+    '''A parsed battleship puzzle.
+
+       row_constraint and col_constraint are the ship counts of the n
+       rows and columns, piece_constraint is the fleet (number of ships
+       of length 1, 2, 3, ..., as a list or a parse_counts string) and
+       board is the list of the n rows
+       of the puzzle as given ('0' unknown, '.' water, anything else is
+       a ship part).
+
+       On initialization the puzzle is also preprocessed the same way
+       battle.py always did: originalB is the board padded with a
+       border of '0's where zero rows/columns and the neighbours of
+       ship part hints have been marked as water, and given lists the
+       (i, j, ch) hints of originalB in padded coordinates.
+
+       fleet is the fleet as a list of counts and piece_constraint its
+       format_counts string.
+    '''
+
+    # Directions for neighbors based on ship parts: the water around the
+    # hint (presolve's _glyphs) and the diagonals between two such cells
+    directions = dict((ch, water + [(di, dj) for (di, _) in water if di for (_, dj) in water if dj])
+                      for (ch, (water, ship)) in _glyphs.items())
+
+    def __init__(self, row_constraint, col_constraint, piece_constraint, board):
+        self.n = len(board)
+        self.size = self.n + 2
+        self.row_constraint = list(row_constraint)
+        self.col_constraint = list(col_constraint)
+        if isinstance(piece_constraint, str):
+            self.fleet = parse_counts(piece_constraint)
+        else:
+            self.fleet = list(piece_constraint)
+        self.piece_constraint = format_counts(self.fleet)
+        self.board = list(board)
+
+        size = self.size
+        originalB = [['0'] * size] + [['0'] + list(row) + ['0'] for row in board] + [['0'] * size]
+
+        # Preprocessing rows/columns with zero constraints
+        for i in range(1, size - 1):
+            for j in range(1, size - 1):
+                if self.row_constraint[i - 1] == 0 or self.col_constraint[j - 1] == 0:
+                    originalB[i][j] = "."
+
+        # Preprocessing known ship parts
+        for i in range(1, size - 1):
+            for j in range(1, size - 1):
+                cell = board[i - 1][j - 1]
+                if cell in Puzzle.directions:
+                    for di, dj in Puzzle.directions[cell]:
+                        ni, nj = i + di, j + dj
+                        if 1 <= ni < size - 1 and 1 <= nj < size - 1 and originalB[ni][nj] == "0":
+                            originalB[ni][nj] = "."
+
+        self.originalB = ["".join(row) for row in originalB]
+        self.given = [(i, j, self.originalB[i][j]) for i in range(1, size - 1)
+                      for j in range(1, size - 1) if self.originalB[i][j] != "0"]
+
+    def __str__(self):
+        return "\n".join([format_counts(self.row_constraint), format_counts(self.col_constraint),
+                          self.piece_constraint] + self.board)
+
+
+def grid_glyphs(grid):
+    '''The ship part glyphs ('.', 'S', '<', '>', '^', 'v', 'M') of a
+       padded grid of 1 (ship) / 0 (water) cells, as the list of the
+       rows of the board.'''
+    size = len(grid)
+    rows = []
+    for i in range(1, size - 1):
+        row = ""
+        for j in range(1, size - 1):
+            if grid[i][j] != 1:
+                row += "."
+            elif grid[i][j-1] == 1 or grid[i][j+1] == 1:
+                row += "M" if grid[i][j-1] == 1 and grid[i][j+1] == 1 else ("<" if grid[i][j+1] == 1 else ">")
+            elif grid[i-1][j] == 1 or grid[i+1][j] == 1:
+                row += "M" if grid[i-1][j] == 1 and grid[i+1][j] == 1 else ("^" if grid[i+1][j] == 1 else "v")
+            else:
+                row += "S"
+        rows.append(row)
+    return rows
+
+
+def parse_puzzle(text):
+    '''Parse a puzzle in the input file format: the row sums, the column
+       sums, the fleet and then one line per board row ('0' unknown,
+       '.' water or a ship glyph S<>^vM). The sums and the fleet are
+       digit strings, or comma separated numbers (see parse_counts) for
+       big boards. Raises ValueError if the text is malformed.'''
+    b2 = text.split()
+    if len(b2) < 4:
+        raise ValueError("malformed puzzle")
+    try:
+        rows, cols, fleet = parse_counts(b2[0]), parse_counts(b2[1]), parse_counts(b2[2])
+    except ValueError:
+        raise ValueError("malformed puzzle")
+    if len(rows) != len(cols) or len(b2) - 3 != len(rows) or any(len(row) != len(rows) for row in b2[3:]):
+        raise ValueError("malformed puzzle")
+    for row in b2[3:]:
+        for ch in row:
+            if ch not in "0.S<>^vM":
+                raise ValueError("malformed puzzle: unknown glyph {!r}".format(ch))
+    return Puzzle(rows, cols, fleet, b2[3:])
+
+
+class BattleshipModel:
+    '''CSP template for all battleship puzzles of one board size.
+
+       The variables, the diagonal and 'connect' constraints and the
+       scopes of the row/column constraints only depend on the size of
+       the board, so they are built (and indexed by CSP) once. load()
+       then makes the model solve a particular puzzle by swapping the
+       row/column and fleet bounds in place and resetting the variable
+       domains to the cells presolve decided.
+
+       Cell variables are named str(-1-(i*size+j)) with domain [0,1]
+       (border cells [0]) and the glyph variables str(i*size+j) with
+       domain ['.','S'], where size is the padded board width n+2.
+    '''
+
+    def __init__(self, n):
+        self.n = n
+        self.size = size = n + 2
+        self.puzzle = None
+
+        varlist = []
+        varn = {}
+        conslist = []
+
+        for i in range(0, size):
+            for j in range(0, size):
+                if i == 0 or i == size-1 or j == 0 or j == size-1:
+                    v = Variable(str(-1-(i*size+j)), [0])
+                else:
+                    v = Variable(str(-1-(i*size+j)), [0,1])
+                varlist.append(v)
+                varn[str(-1-(i*size+j))] = v
+
+        self.rows = []
+        for row in range(0, size):
+            c = NValuesConstraint('row', [varn[str(-1-(row*size+col))] for col in range(0, size)], [1], 0, 0)
+            self.rows.append(c)
+            conslist.append(c)
+
+        self.cols = []
+        for col in range(0, size):
+            c = NValuesConstraint('col', [varn[str(-1-(col+row*size))] for row in range(0, size)], [1], 0, 0)
+            self.cols.append(c)
+            conslist.append(c)
+
+        #diagonal constraints on 1/0 variables
+        for i in range(1, size-1):
+            for j in range(1, size-1):
+                conslist.append(NValuesConstraint('diag', [varn[str(-1-(i*size+j))], varn[str(-1-((i-1)*size+(j-1)))]], [1], 0, 1))
+                conslist.append(NValuesConstraint('diag', [varn[str(-1-(i*size+j))], varn[str(-1-((i-1)*size+(j+1)))]], [1], 0, 1))
+
+        self.fleet = FleetConstraint('fleet', [[varn[str(-1-(i*size+j))] for j in range(0, size)] for i in range(0, size)], [])
+        conslist.append(self.fleet)
+
+        for i in range(0, size):
+            for j in range(0, size):
+                v = Variable(str(i*size+j), ['.', 'S'])
+                varlist.append(v)
+                varn[str(i*size+j)] = v
+                conslist.append(TableConstraint('connect', [varn[str(-1-(i*size+j))], varn[str(i*size+j)]], [[0,'.'],[1,'S']]))
+
+        self.varn = varn
+        self.csp = CSP('battleship', varlist, conslist)
+        self.lines = fleet_lines(size)
+        self.presolved = None
+        self.satSolver = None
+        self.regions = None
+        self.status = None
+        self.partial = None
+
+    def cell(self, i, j):
+        '''return the 0/1 variable of (padded) cell i, j'''
+        return self.varn[str(-1-(i*self.size+j))]
+
+    def load(self, puzzle):
+        '''Set the model up to solve puzzle, which must have the model's
+           size. The puzzle is presolved first, see self.presolved.'''
+        if puzzle.n != self.n:
+            raise ValueError("puzzle of size {} loaded into a model of size {}".format(puzzle.n, self.n))
+        size = self.size
+        Variable.clearUndoDict()
+        self.presolved = presolve(puzzle, self.lines)
+        grid = self.presolved.grid
+        self.fleet.setFleet(puzzle.fleet)
+        for i in range(1, size-1):
+            self.rows[i].setBounds(puzzle.row_constraint[i-1], puzzle.row_constraint[i-1])
+            self.cols[i].setBounds(puzzle.col_constraint[i-1], puzzle.col_constraint[i-1])
+            for j in range(1, size-1):
+                if grid[i][j] is None:
+                    self.cell(i, j).resetDomain([0,1])
+                else:
+                    self.cell(i, j).resetDomain([grid[i][j]])
+        for v in self.csp.variables():
+            v.reset()
+        self.puzzle = puzzle
+
+    def gridSolution(self, grid):
+        '''turn a fully decided grid into a solution in bt_search's format'''
+        size = self.size
+        return [(self.varn[str(i*size+j)], 'S' if grid[i][j] == 1 else '.')
+                for i in range(0, size) for j in range(0, size) if i*size+j > 0]
+
+    def solutionGrid(self, sol):
+        '''turn a solution in bt_search's format into a padded grid of 1 (ship) / 0 (water)'''
+        size = self.size
+        grid = [[0] * size for i in range(size)]
+        for (var, val) in sol:
+            k = int(var.name())
+            if val == 'S':
+                grid[k // size][k % size] = 1
+        return grid
+
+    def solve(self, algo='GAC', variableHeuristic='mrv', valueHeuristic='domain', restarts=None, seed=None, solutionLimit=1,
+              timeLimit=None, nodeLimit=None, cancel=None, decompose=True, probeDepth=None, probeLimit=None,
+              trace=None):
+        '''Solve the loaded puzzle, returns bt_search's (solutions, nodes).
+           Puzzles presolve already solved (or refuted) do not enter the
+           search, bt_search.nodesExplored is then 0.
+
+           With decompose, boards whose undecided cells split into
+           independent regions are solved region by region with
+           solve_regions instead (nodes is then the number of nodes of
+           the region enumerations, self.regions holds its statistics).
+
+           algo 'SAT' solves the puzzle with the CDCL backend of sat.py
+           instead (nodes is then the number of decisions, the solver is
+           left in self.satSolver for its statistics).
+
+           solutionLimit is the number of solutions to look for (None for
+           all), 2 tells unique puzzles apart. timeLimit (seconds),
+           nodeLimit and cancel bound the search as in bt_search.
+           probeDepth and probeLimit turn on bt_search's failed literal
+           probing (GAC only). trace, a file path, gets a binary trace
+           of the GAC search (see searchtrace.py), one with no records
+           when the puzzle is solved without it.
+
+           self.status is then 'solved', 'unsat', 'timeout' or 'cancelled'
+           and, for the last two, self.partial is the padded board of 1
+           (ship) / 0 (water) / None (unknown) cells of the partial
+           assignment the search stopped at.'''
+        p = self.puzzle
+        self.satSolver = None
+        self.regions = None
+        self.partial = None
+        if self.presolved.solved() or not self.presolved.consistent:
+            self._noSearch(0, trace)
+            sols = [self.gridSolution(self.presolved.grid)] if self.presolved.consistent else []
+            self.status = 'solved' if sols else 'unsat'
+            return sols, 0
+        budget = SearchBudget(nodeLimit, None, solutionLimit, time.time() + timeLimit if timeLimit is not None else None, cancel)
+        if decompose:
+            parts = solve_regions(p, self.presolved.grid, solutionLimit, budget)
+            if parts is not None:
+                grids, self.regions = parts
+                self._noSearch(self.regions['nodes'], trace)
+                self.status = self.regions['status']
+                if self.status in ('timeout', 'cancelled'):
+                    self.partial = [list(row) for row in self.presolved.grid]
+                return [self.gridSolution(grid) for grid in grids], self.regions['nodes']
+        if algo == 'SAT':
+            if trace is not None:
+                TraceWriter(trace, self.csp, self.size).close()
+            grids, self.satSolver = sat_solve(p, self.presolved.grid, solutionLimit, budget)
+            self.status = self.satSolver.status
+            self.partial = self.satSolver.partial
+            return [self.gridSolution(grid) for grid in grids], self.satSolver.decisions
+        sols, nodes = bt_search(algo, self.csp, variableHeuristic, solutionLimit != 1, trace, p.fleet, p.originalB, p.given,
+                                self.size, valueHeuristic, restarts, seed, solutionLimit=solutionLimit,
+                                timeLimit=timeLimit, nodeLimit=nodeLimit, cancel=cancel,
+                                probeDepth=probeDepth, probeLimit=probeLimit)
+        self.status = bt_search.status
+        if self.status in ('timeout', 'cancelled'):
+            self.partial = [list(row) for row in self.presolved.grid]
+            for (var, val) in bt_search.partial:
+                k = -1 - int(var.name())
+                self.partial[k // self.size][k % self.size] = val
+        return sols, nodes
+
+    def _noSearch(self, nodes, trace=None):
+        '''reset bt_search's statistics when the puzzle is solved without
+           it, and write a trace with no records to trace (a path) if given'''
+        if trace is not None:
+            TraceWriter(trace, self.csp, self.size).close()
+        bt_search.nodesExplored = nodes
+        bt_search.lcvTrials = 0
+        bt_search.lcvCacheHits = 0
+        bt_search.decisions = 0
+        bt_search.restarts = 0
+        bt_search.probes = 0
+        bt_search.probeFixed = 0
+        bt_search.probeTime = 0.0
+
+
+class SolveResult:
+    '''Outcome of solve_puzzle.
+
+       status is 'solved', 'unsat', 'timeout' or 'cancelled'. solutions
+       lists the solutions found as boards (lists of rows of glyphs, like
+       the output files), partial is the padded board of 1 (ship) /
+       0 (water) / None (unknown) cells the search reached before it
+       timed out or was cancelled (None otherwise). nodes, decisions
+       and elapsed (seconds) are the search statistics and fixed the
+       number of cells presolve decided.'''
+    def __init__(self, status, solutions, nodes, decisions, elapsed, fixed, partial=None):
+        self.status = status
+        self.solutions = solutions
+        self.nodes = nodes
+        self.decisions = decisions
+        self.elapsed = elapsed
+        self.fixed = fixed
+        self.partial = partial
+
+    def solution(self):
+        '''the first solution as text, None if there is none'''
+        return "\n".join(self.solutions[0]) if self.solutions else None
+
+    def stats(self):
+        return {"status": self.status, "time": self.elapsed, "nodes": self.nodes,
+                "decisions": self.decisions, "presolveFixed": self.fixed}
+
+
+def solve_puzzle(puzzle, **options):
+    '''Solve puzzle (a Puzzle) with this process's warm model for its
+       size. options are the keyword arguments of BattleshipModel.solve
+       (e.g. algo='SAT', timeLimit=10, cancel=threading.Event()).
+       Returns a SolveResult.'''
+    t_start = time.time()
+    model = warm_model(puzzle.n)
+    model.load(puzzle)
+    sols, nodes = model.solve(**options)
+    if model.satSolver is not None:
+        decisions = model.satSolver.decisions
+    else:
+        decisions = bt_search.decisions
+    return SolveResult(model.status, [grid_glyphs(model.solutionGrid(sol)) for sol in sols], nodes, decisions,
+                       time.time() - t_start, model.presolved.fixed, model.partial)
+
+
+def memory_report(model):
+    '''Measure the memory held by model (its CSP, constraint tables and
+       indexes): returns a dict with the number of Variable and Constraint
+       objects, the number and bytes of all the objects reachable from
+       the model (shared objects counted once, interpreter cached small
+       ints, None and booleans not at all) and the bytes per board cell.'''
+    seen = set()
+    counts = {'variables': 0, 'constraints': 0, 'objects': 0}
+    total = 0
+    stack = [model]
+    while stack:
+        obj = stack.pop()
+        if obj is None or isinstance(obj, bool) or isinstance(obj, int) and -5 <= obj <= 256 or id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        counts['objects'] += 1
+        total += sys.getsizeof(obj)
+        if isinstance(obj, Variable):
+            counts['variables'] += 1
+        elif isinstance(obj, Constraint):
+            counts['constraints'] += 1
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, int, float)):
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    stack.append(getattr(obj, slot, None))
+    counts['bytes'] = total
+    counts['bytesPerCell'] = total / (model.n * model.n)
+    return counts
+
+
+_models = dict()   #warm models of this process, by board size
+
+def warm_model(n):
+    '''return this process's BattleshipModel for size n boards, building
+       it the first time (for batch processes and pool workers)'''
+    if n not in _models:
+        _models[n] = BattleshipModel(n)
+    return _models[n]
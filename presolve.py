@@ -0,0 +1,144 @@
+from constraints import fleet_lines, fleet_deductions
+
+
+class Contradiction(Exception):
+    '''Raised by presolve when a deduction conflicts with the puzzle'''
+    pass
+
+
+class PresolveResult:
+    '''Outcome of presolve.
+
+       grid is the padded board (grid[i][j] for i, j in 0..size-1, border
+       cells are 0) with 1 for ship, 0 for water and None for the cells
+       presolve could not decide. fixed is the number of cells presolve
+       decided that were not given as hints, and consistent is False if
+       the deductions ran into a contradiction (the puzzle has no
+       solution).
+    '''
+    def __init__(self, grid, fixed, consistent):
+        self.grid = grid
+        self.fixed = fixed
+        self.consistent = consistent
+
+    def unknown(self):
+        '''number of cells left undecided'''
+        return sum(row.count(None) for row in self.grid)
+
+    def solved(self):
+        return self.consistent and self.unknown() == 0
+
+
+def _set(grid, i, j, val):
+    '''record grid[i][j] = val, return True if that is new'''
+    if grid[i][j] is None:
+        grid[i][j] = val
+        return True
+    if grid[i][j] != val:
+        raise Contradiction("cell {},{} must be both {} and {}".format(i, j, grid[i][j], val))
+    return False
+
+# cells around a hint glyph that are (0) water and (1) ship, also used by
+# the SAT encoding and Puzzle.directions
+_glyphs = {
+    "S": ([(-1, 0), (1, 0), (0, -1), (0, 1)], []),
+    "<": ([(-1, 0), (1, 0), (0, -1)], [(0, 1)]),
+    ">": ([(-1, 0), (1, 0), (0, 1)], [(0, -1)]),
+    "^": ([(0, -1), (0, 1), (-1, 0)], [(1, 0)]),
+    "v": ([(0, -1), (0, 1), (1, 0)], [(-1, 0)]),
+}
+
+def _hint(grid, i, j, ch):
+    '''extend the ship part hint ch at i, j'''
+    changed = False
+    if ch in _glyphs:
+        water, ship = _glyphs[ch]
+        for (di, dj) in water:
+            changed |= _set(grid, i+di, j+dj, 0)
+        for (di, dj) in ship:
+            changed |= _set(grid, i+di, j+dj, 1)
+    elif ch == "M":
+        #a middle piece continues on both sides of one axis, water on the other
+        if grid[i][j-1] == 0 or grid[i][j+1] == 0 or grid[i-1][j] == 1 or grid[i+1][j] == 1:
+            for (di, dj, val) in [(-1, 0, 1), (1, 0, 1), (0, -1, 0), (0, 1, 0)]:
+                changed |= _set(grid, i+di, j+dj, val)
+        if grid[i-1][j] == 0 or grid[i+1][j] == 0 or grid[i][j-1] == 1 or grid[i][j+1] == 1:
+            for (di, dj, val) in [(0, -1, 1), (0, 1, 1), (-1, 0, 0), (1, 0, 0)]:
+                changed |= _set(grid, i+di, j+dj, val)
+    return changed
+
+def _line(grid, cells, total):
+    '''row/column sum: fill or water the unknown cells of a line'''
+    ships = sum(1 for (i, j) in cells if grid[i][j] == 1)
+    unknown = [(i, j) for (i, j) in cells if grid[i][j] is None]
+    if ships > total or ships + len(unknown) < total:
+        raise Contradiction("line sum {} cannot be met".format(total))
+    if not unknown:
+        return False
+    if ships == total:
+        val = 0
+    elif ships + len(unknown) == total:
+        val = 1
+    else:
+        return False
+    for (i, j) in unknown:
+        _set(grid, i, j, val)
+    return True
+
+def presolve(puzzle, lines=None):
+    '''Human style deductions on puzzle iterated to a fixpoint: hints and
+       their glyph shapes, water diagonal to ships, row/column sums
+       already met or only met by filling every unknown cell, and
+       the fleet_deductions (which place the biggest ships when only
+       as many places as ships are left). lines are the fleet_lines of
+       the puzzle's size, pass them in to avoid recomputing them.
+
+       Returns a PresolveResult.'''
+    size = puzzle.size
+    n = puzzle.n
+    if lines is None:
+        lines = fleet_lines(size)
+    fleet = puzzle.fleet
+    interior = [(i, j) for i in range(1, size-1) for j in range(1, size-1)]
+    rows = [[(i, j) for j in range(1, size-1)] for i in range(1, size-1)]
+    cols = [[(i, j) for i in range(1, size-1)] for j in range(1, size-1)]
+
+    grid = [[0] * size] + [[0] + [None] * n + [0] for i in range(n)] + [[0] * size]
+    hints = []
+    given = 0
+    try:
+        for (i, j) in interior:
+            ch = puzzle.board[i-1][j-1]
+            if ch != '0':
+                given += 1
+                _set(grid, i, j, 0 if ch == '.' else 1)
+                if ch != '.':
+                    hints.append((i, j, ch))
+
+        changed = True
+        while changed:
+            changed = False
+            for (i, j, ch) in hints:
+                changed |= _hint(grid, i, j, ch)
+            for (i, j) in interior:
+                if grid[i][j] == 1:
+                    for (di, dj) in [(-1, -1), (-1, 1), (1, -1), (1, 1)]:
+                        changed |= _set(grid, i+di, j+dj, 0)
+            for k in range(n):
+                changed |= _line(grid, rows[k], puzzle.row_constraint[k])
+                changed |= _line(grid, cols[k], puzzle.col_constraint[k])
+            if changed:
+                continue
+
+            can0 = [grid[k // size][k % size] != 1 for k in range(size * size)]
+            can1 = [grid[k // size][k % size] != 0 for k in range(size * size)]
+            deductions = fleet_deductions(lines, fleet, can0, can1, [i*size+j for (i, j) in interior])
+            if deductions is None:
+                raise Contradiction("the fleet no longer fits")
+            for (ks, val) in ((deductions[0], 0), (deductions[1], 1)):
+                for k in ks:
+                    changed |= _set(grid, k // size, k % size, val)
+    except Contradiction:
+        return PresolveResult(grid, sum(n - row.count(None) for row in grid[1:-1]) - given, False)
+
+    return PresolveResult(grid, sum(n - row.count(None) for row in grid[1:-1]) - given, True)
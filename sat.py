@@ -0,0 +1,412 @@
+import heapq
+from constraints import fleet_lines
+from backtracking import luby, SearchTimeout
+from presolve import _glyphs
+
+
+class CNF:
+    '''A CNF formula under construction. Variables are the integers
+       1..nvars and literals are +v / -v (DIMACS style); clauses is the
+       list of clauses, each a list of literals.'''
+
+    def __init__(self):
+        self.nvars = 0
+        self.clauses = []
+        self.false = self.newVar()   #a literal fixed to false, for the border cells
+        self.add([-self.false])
+
+    def newVar(self):
+        self.nvars += 1
+        return self.nvars
+
+    def add(self, clause):
+        self.clauses.append(list(clause))
+
+    def totalizer(self, lits, k):
+        '''return outputs o with o[i-1] <-> (at least i of lits are true),
+           for i up to k+1 (the counts above are not told apart)'''
+        if len(lits) == 1:
+            return list(lits)
+        left = self.totalizer(lits[:len(lits) // 2], k)
+        right = self.totalizer(lits[len(lits) // 2:], k)
+        m = min(len(left) + len(right), k + 1)
+        out = [self.newVar() for i in range(m)]
+        for i in range(len(left) + 1):
+            for j in range(len(right) + 1):
+                #left >= i and right >= j implies out >= i+j
+                if 0 < i + j:
+                    clause = [out[min(i + j, m) - 1]]
+                    if i > 0:
+                        clause.append(-left[i - 1])
+                    if j > 0:
+                        clause.append(-right[j - 1])
+                    self.add(clause)
+                #left < i+1 and right < j+1 implies out < i+j+1
+                if i + j < m:
+                    clause = [-out[i + j]]
+                    if i < len(left):
+                        clause.append(left[i])
+                    if j < len(right):
+                        clause.append(right[j])
+                    self.add(clause)
+        return out
+
+    def exactly(self, lits, k):
+        '''exactly k of lits are true (a totalizer encoding)'''
+        if k < 0 or k > len(lits):
+            self.add([])
+        elif k == 0:
+            for lit in lits:
+                self.add([-lit])
+        elif k == len(lits):
+            for lit in lits:
+                self.add([lit])
+        else:
+            out = self.totalizer(lits, k)
+            self.add([out[k - 1]])
+            if k < len(out):
+                self.add([-out[k]])
+
+
+def encode_puzzle(puzzle, grid=None, budget=None):
+    '''Compile puzzle to CNF. Returns (cnf, cells) where cells[i][j] is
+       the literal of padded cell i, j being a ship (cnf.false on the
+       border). grid, e.g. a PresolveResult.grid, adds the cells it
+       decides as unit clauses. budget, a backtracking.SearchBudget, is
+       checked once per row/column and per line of ship placements (big
+       boards take seconds to encode).
+
+       Besides the hints and the diagonal exclusions, the row/column sums
+       and the fleet are cardinality constraints: every placement of a
+       ship of length L gets a variable that is true iff its cells are
+       ships and the cells around them water, every ship cell must be in
+       a true placement and exactly fleet[L] placements of length L are
+       true.'''
+    size = puzzle.size
+    cnf = CNF()
+    cells = [[cnf.false] * size for i in range(size)]
+    for i in range(1, size-1):
+        for j in range(1, size-1):
+            cells[i][j] = cnf.newVar()
+    interior = [(i, j) for i in range(1, size-1) for j in range(1, size-1)]
+
+    for (i, j) in interior:
+        ch = puzzle.board[i-1][j-1]
+        if ch == '.':
+            cnf.add([-cells[i][j]])
+        elif ch != '0':
+            cnf.add([cells[i][j]])
+        if ch in _glyphs:
+            water, ship = _glyphs[ch]
+            for (di, dj) in water:
+                cnf.add([-cells[i+di][j+dj]])
+            for (di, dj) in ship:
+                cnf.add([cells[i+di][j+dj]])
+        elif ch == 'M':
+            h = cnf.newVar()   #true for a horizontal ship
+            for (di, dj) in [(0, -1), (0, 1)]:
+                cnf.add([-h, cells[i+di][j+dj]])
+                cnf.add([h, -cells[i+di][j+dj]])
+            for (di, dj) in [(-1, 0), (1, 0)]:
+                cnf.add([-h, -cells[i+di][j+dj]])
+                cnf.add([h, cells[i+di][j+dj]])
+        if grid is not None and grid[i][j] is not None:
+            cnf.add([cells[i][j] if grid[i][j] == 1 else -cells[i][j]])
+
+        #diagonal constraints
+        for (di, dj) in [(-1, -1), (-1, 1)]:
+            if 1 <= i+di < size-1 and 1 <= j+dj < size-1:
+                cnf.add([-cells[i][j], -cells[i+di][j+dj]])
+
+    for k in range(1, size-1):
+        if budget is not None:
+            budget.check(0, 0)
+        cnf.exactly([cells[k][j] for j in range(1, size-1)], puzzle.row_constraint[k-1])
+        cnf.exactly([cells[i][k] for i in range(1, size-1)], puzzle.col_constraint[k-1])
+
+    fleet = puzzle.fleet
+    covering = dict()
+    for (L, lines) in fleet_lines(size).items():
+        placements = []
+        for line in lines:
+            if budget is not None:
+                budget.check(0, 0)
+            for (start, body, ring) in line:
+                y = cnf.newVar()
+                body = [cells[k // size][k % size] for k in body]
+                ring = [cells[k // size][k % size] for k in ring]
+                for lit in body:
+                    cnf.add([-y, lit])
+                    covering.setdefault(lit, []).append(y)
+                for lit in ring:
+                    cnf.add([-y, -lit])
+                cnf.add([y] + [-lit for lit in body] + ring)
+                placements.append(y)
+        cnf.exactly(placements, fleet[L-1] if L <= len(fleet) else 0)
+    for (i, j) in interior:
+        cnf.add([-cells[i][j]] + covering.get(cells[i][j], []))
+    return cnf, cells
+
+
+class CDCLSolver:
+    '''Conflict driven clause learning SAT solver: two watched literals
+       per clause, first UIP clause learning with non-chronological
+       backjumping, VSIDS variable activities (kept in a lazy heap),
+       phase saving and Luby restarts.
+
+       solve() returns True (the model is then in value()) or False.
+       decisions, conflicts and propagations count the work done.
+       budget, a backtracking.SearchBudget, is checked every 4096
+       clauses added by the constructor.
+    '''
+
+    def __init__(self, nvars, clauses, restartBase=100, budget=None):
+        self.nvars = nvars
+        self._value = [0] * (nvars + 1)       #1 true, -1 false, 0 unassigned
+        self._level = [0] * (nvars + 1)
+        self._reason = [None] * (nvars + 1)
+        self._phase = [False] * (nvars + 1)
+        self._activity = [0.0] * (nvars + 1)
+        self._inc = 1.0
+        self._heap = [(0.0, v) for v in range(1, nvars + 1)]
+        self._watches = [[] for i in range(2 * nvars + 2)]
+        self._trail = []
+        self._trailLim = []
+        self._qhead = 0
+        self._restartBase = restartBase
+        self.learnts = 0
+        self.decisions = 0
+        self.conflicts = 0
+        self.propagations = 0
+        self._ok = True
+        for (k, c) in enumerate(clauses):
+            if budget is not None and not k & 4095:
+                budget.check(0, 0)
+            self.addClause(c)
+
+    @staticmethod
+    def _w(lit):
+        return 2 * lit if lit > 0 else -2 * lit + 1
+
+    def _litValue(self, lit):
+        v = self._value[abs(lit)]
+        return v if lit > 0 else -v
+
+    def addClause(self, clause):
+        '''add a clause, also between calls to solve (e.g. to block the
+           model found, the solver keeps its learnt clauses)'''
+        self._backtrack(0)
+        if not self._ok:
+            return
+        lits = []
+        seen = set()
+        for lit in clause:
+            if -lit in seen:
+                return    #tautology
+            if lit not in seen:
+                seen.add(lit)
+                lits.append(lit)
+        lits = [lit for lit in lits if self._litValue(lit) != -1 or self._level[abs(lit)] > 0]
+        if any(self._litValue(lit) == 1 and self._level[abs(lit)] == 0 for lit in lits):
+            return    #already satisfied
+        if not lits:
+            self._ok = False
+        elif len(lits) == 1:
+            if self._litValue(lits[0]) == -1:
+                self._ok = False
+            elif self._litValue(lits[0]) == 0:
+                self._enqueue(lits[0], None)
+        else:
+            self._watches[self._w(lits[0])].append(lits)
+            self._watches[self._w(lits[1])].append(lits)
+
+    def _enqueue(self, lit, reason):
+        v = abs(lit)
+        self._value[v] = 1 if lit > 0 else -1
+        self._level[v] = len(self._trailLim)
+        self._reason[v] = reason
+        self._trail.append(lit)
+
+    def _propagate(self):
+        '''unit propagation, returns a conflicting clause or None'''
+        while self._qhead < len(self._trail):
+            falseLit = -self._trail[self._qhead]
+            self._qhead += 1
+            self.propagations += 1
+            ws = self._watches[self._w(falseLit)]
+            i = j = 0
+            while i < len(ws):
+                c = ws[i]
+                i += 1
+                if c[0] == falseLit:
+                    c[0], c[1] = c[1], c[0]
+                if self._litValue(c[0]) == 1:
+                    ws[j] = c
+                    j += 1
+                    continue
+                for k in range(2, len(c)):
+                    if self._litValue(c[k]) != -1:
+                        c[1], c[k] = c[k], c[1]
+                        self._watches[self._w(c[1])].append(c)
+                        break
+                else:
+                    ws[j] = c
+                    j += 1
+                    if self._litValue(c[0]) == -1:
+                        while i < len(ws):
+                            ws[j] = ws[i]
+                            j += 1
+                            i += 1
+                        del ws[j:]
+                        return c
+                    self._enqueue(c[0], c)
+            del ws[j:]
+        return None
+
+    def _bump(self, v):
+        self._activity[v] += self._inc
+        if self._activity[v] > 1e100:
+            for u in range(1, self.nvars + 1):
+                self._activity[u] *= 1e-100
+            self._inc *= 1e-100
+            self._heap = [(-self._activity[u], u) for u in range(1, self.nvars + 1) if self._value[u] == 0]
+            heapq.heapify(self._heap)
+        elif self._value[v] == 0:
+            heapq.heappush(self._heap, (-self._activity[v], v))
+
+    def _analyse(self, conflict):
+        '''first UIP learning, returns (learnt clause, backjump level)'''
+        level = len(self._trailLim)
+        seen = set()
+        learnt = [None]
+        counter = 0
+        p = None
+        index = len(self._trail) - 1
+        clause = conflict
+        while True:
+            for q in (clause if p is None else clause[1:]):
+                v = abs(q)
+                if v not in seen and self._level[v] > 0:
+                    seen.add(v)
+                    self._bump(v)
+                    if self._level[v] == level:
+                        counter += 1
+                    else:
+                        learnt.append(q)
+            while abs(self._trail[index]) not in seen:
+                index -= 1
+            p = self._trail[index]
+            index -= 1
+            clause = self._reason[abs(p)]
+            seen.discard(abs(p))
+            counter -= 1
+            if counter == 0:
+                break
+        learnt[0] = -p
+        if len(learnt) == 1:
+            return learnt, 0
+        best = max(range(1, len(learnt)), key=lambda k: self._level[abs(learnt[k])])
+        learnt[1], learnt[best] = learnt[best], learnt[1]
+        return learnt, self._level[abs(learnt[1])]
+
+    def _backtrack(self, level):
+        if len(self._trailLim) <= level:
+            return
+        for lit in self._trail[self._trailLim[level]:]:
+            v = abs(lit)
+            self._phase[v] = lit > 0
+            self._value[v] = 0
+            self._reason[v] = None
+            heapq.heappush(self._heap, (-self._activity[v], v))
+        del self._trail[self._trailLim[level]:]
+        del self._trailLim[level:]
+        self._qhead = len(self._trail)
+
+    def _pick(self):
+        while self._heap:
+            act, v = heapq.heappop(self._heap)
+            if self._value[v] == 0:
+                return v
+        return None
+
+    def solve(self, budget=None):
+        '''budget, if given, is a backtracking.SearchBudget checked with
+           the number of decisions after every decision and conflict (it
+           raises to abandon the search)'''
+        if not self._ok:
+            return False
+        run = 1
+        restartAt = self._restartBase * luby(run)
+        sinceRestart = 0
+        while True:
+            conflict = self._propagate()
+            if conflict is not None:
+                self.conflicts += 1
+                sinceRestart += 1
+                if not self._trailLim:
+                    self._ok = False
+                    return False
+                learnt, level = self._analyse(conflict)
+                self._backtrack(level)
+                if len(learnt) == 1:
+                    self._enqueue(learnt[0], None)
+                else:
+                    self._watches[self._w(learnt[0])].append(learnt)
+                    self._watches[self._w(learnt[1])].append(learnt)
+                    self._enqueue(learnt[0], learnt)
+                self.learnts += 1
+                self._inc /= 0.95
+                if budget is not None:
+                    budget.check(self.decisions, self.decisions)
+                if sinceRestart >= restartAt:
+                    self._backtrack(0)
+                    run += 1
+                    restartAt = self._restartBase * luby(run)
+                    sinceRestart = 0
+            else:
+                v = self._pick()
+                if v is None:
+                    return True
+                self.decisions += 1
+                if budget is not None:
+                    budget.check(self.decisions, self.decisions)
+                self._trailLim.append(len(self._trail))
+                self._enqueue(v if self._phase[v] else -v, None)
+
+    def value(self, lit):
+        '''value of lit in the model found'''
+        return self._litValue(lit) == 1
+
+
+def sat_solve(puzzle, grid=None, solutionLimit=1, budget=None):
+    '''Solve puzzle with the CDCL solver. Returns (grids, solver) where
+       grids lists up to solutionLimit solutions (None for all of them),
+       each the padded board of 1 (ship) / 0 (water). Further solutions
+       are found by blocking the ones found so far.
+
+       budget is a backtracking.SearchBudget (its node limit counts
+       decisions). solver.status is 'solved', 'unsat', 'timeout' or
+       'cancelled', in the last two cases solver.partial is the padded
+       board of the cells decided when the search stopped (None for the
+       others). The budget also bounds encoding and loading the CNF, if
+       it runs out before the solver is built solver is an empty one and
+       solver.partial the cells grid decides.'''
+    grids = []
+    solver = None
+    try:
+        cnf, cells = encode_puzzle(puzzle, grid, budget)
+        solver = CDCLSolver(cnf.nvars, cnf.clauses, budget=budget)
+        solver.partial = None
+        while (solutionLimit is None or len(grids) < solutionLimit) and solver.solve(budget):
+            grids.append([[1 if solver.value(lit) else 0 for lit in row] for row in cells])
+            solver.addClause([-lit if solver.value(lit) else lit for row in cells[1:-1] for lit in row[1:-1]])
+        solver.status = 'solved' if grids else 'unsat'
+    except SearchTimeout as e:
+        if solver is None:
+            solver = CDCLSolver(0, [])
+            solver.status = e.status
+            solver.partial = [list(row) for row in grid] if grid is not None else None
+            return grids, solver
+        solver.status = e.status
+        solver.partial = [[None if solver._litValue(lit) == 0 else int(solver.value(lit)) for lit in row] for row in cells]
+    return grids, solver
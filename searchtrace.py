@@ -0,0 +1,299 @@
+import sys
+import struct
+import argparse
+
+# A trace is a header followed by fixed size records.
+# header: MAGIC, board size (padded) and number of constraints, then for
+# each constraint (in csp.constraints() order) its label as a 2 byte
+# length and utf-8 bytes.
+# record: kind, depth, variable (the int of its name), value (1 for a
+# ship, 1 or 'S', 0 for water), arg
+MAGIC = b'BSTRACE1'
+_header = struct.Struct('<HI')
+_label = struct.Struct('<H')
+_record = struct.Struct('<BHibI')
+
+NODE = 0        #a node expanded on var, arg is the number of values to try
+ASSIGN = 1      #var=val tried at the node at depth
+PROPAGATE = 2   #constraint arg pruned depth values (no variable)
+WIPEOUT = 3     #constraint arg wiped out a domain under the last assignment
+BACKTRACK = 4   #the node on var at depth exhausted its values without a solution
+SOLUTION = 5    #a solution found at depth
+RESTART = 6     #the search restarted from the root
+PROBE = 7       #probing var=val failed, the value was pruned (see Prober)
+
+KINDS = ['node', 'assign', 'propagate', 'wipeout', 'backtrack', 'solution', 'restart', 'probe']
+
+
+def cell_of(var, size):
+    '''the 0-based (row, column) of the board cell of the variable
+       named var (cell variables are negative, glyph variables not)'''
+    k = -1 - var if var < 0 else var
+    return (k // size - 1, k % size - 1)
+
+def constraint_label(cnstr, size):
+    '''the constraint's name and the span of the board cells of its
+       scope (of the padding cells if it has none)'''
+    cells = [cell_of(int(v.name()), size) for v in cnstr.scope()]
+    cells = [(i, j) for (i, j) in cells if 0 <= i < size-2 and 0 <= j < size-2] or cells
+    (i0, j0), (i1, j1) = min(cells), max(cells)
+    if (i0, j0) == (i1, j1):
+        return "{} r{}c{}".format(cnstr.name(), i0, j0)
+    return "{} r{}c{}..r{}c{}".format(cnstr.name(), i0, j0, i1, j1)
+
+
+class TraceWriter:
+    '''Write a binary search trace of a csp to path through a buffered
+       writer of bufferSize bytes. Each event is one fixed size record;
+       the constraints and variables are numbered once here so that the
+       search only pays for a dict lookup and a struct pack per event.'''
+    def __init__(self, path, csp, size, bufferSize=1 << 16):
+        self.file = open(path, 'wb', buffering=bufferSize)
+        self.size = size
+        self.records = 0
+        constraints = csp.constraints()
+        self._cid = {c: k for (k, c) in enumerate(constraints)}
+        self._vid = {v: int(v.name()) for v in csp.variables()}
+        self.file.write(MAGIC)
+        self.file.write(_header.pack(size, len(constraints)))
+        for c in constraints:
+            label = constraint_label(c, size).encode('utf-8')
+            self.file.write(_label.pack(len(label)))
+            self.file.write(label)
+        self._write = self.file.write
+        self._pack = _record.pack
+
+    def node(self, depth, var, nvals):
+        self.records += 1
+        self._write(self._pack(NODE, depth, self._vid[var], 0, nvals))
+
+    def assign(self, depth, var, val):
+        self.records += 1
+        self._write(self._pack(ASSIGN, depth, self._vid[var], val == 1 or val == 'S', 0))
+
+    def propagate(self, cnstr, pruned):
+        self.records += 1
+        self._write(self._pack(PROPAGATE, min(pruned, 0xffff), 0, 0, self._cid[cnstr]))
+
+    def wipeout(self, cnstr):
+        self.records += 1
+        self._write(self._pack(WIPEOUT, 0, 0, 0, self._cid[cnstr]))
+
+    def backtrack(self, depth, var):
+        self.records += 1
+        self._write(self._pack(BACKTRACK, depth, self._vid[var], 0, 0))
+
+    def solution(self, depth):
+        self.records += 1
+        self._write(self._pack(SOLUTION, depth, 0, 0, 0))
+
+    def restart(self):
+        self.records += 1
+        self._write(self._pack(RESTART, 0, 0, 0, 0))
+
+    def probe(self, var, val):
+        self.records += 1
+        self._write(self._pack(PROBE, 0, self._vid[var], val == 1 or val == 'S', 0))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(path):
+    '''Returns (size, labels, records): the padded board size, the
+       constraint labels and an iterator over the (kind, depth, var, val,
+       arg) records of the trace file path. Raises ValueError if path is
+       not a trace; a record cut short (a search killed mid write) ends
+       the records.'''
+    f = open(path, 'rb')
+    if f.read(len(MAGIC)) != MAGIC:
+        f.close()
+        raise ValueError("{} is not a search trace".format(path))
+    size, count = _header.unpack(f.read(_header.size))
+    labels = []
+    for _ in range(count):
+        (length,) = _label.unpack(f.read(_label.size))
+        labels.append(f.read(length).decode('utf-8'))
+
+    def records():
+        with f:
+            while True:
+                chunk = f.read(_record.size * 4096)
+                end = len(chunk) - len(chunk) % _record.size
+                yield from _record.iter_unpack(chunk[:end])
+                if len(chunk) < _record.size * 4096:
+                    return
+    return size, labels, records()
+
+
+class Frame:
+    '''an assignment on the replayed search path, charge tells if it is
+       the first on the path for its cell (a cell has a 0/1 and a glyph
+       variable, the second assignment is nested in the first)'''
+    __slots__ = ('depth', 'var', 'val', 'cell', 'decision', 'charge', 'nodes', 'solutions')
+    def __init__(self, depth, var, val, cell, decision, charge):
+        self.depth = depth
+        self.var = var
+        self.val = val
+        self.cell = cell
+        self.decision = decision
+        self.charge = charge
+        self.nodes = 0
+        self.solutions = 0
+
+
+def replay(path, maxStack=None):
+    '''Replay the trace file path. Returns a dict of:
+       failed, per (row, column, value) the nodes explored under the
+       assignments of that cell that led to no solution; backtracks, per
+       (row, column) the nodes on the cell that ran out of values;
+       wipeouts and pruned, per constraint label the domain wipeouts it
+       caused and the values it pruned; probes, per (row, column, value)
+       the failed probes; histogram, the number of nodes per decision
+       depth; folded, the wipeouts per stack of decisions (the first
+       maxStack ones, all if None) as flame graph folded stacks; and the
+       totals nodes, solutions and restarts.
+
+       Each cell is charged once per path, so no per cell total exceeds
+       nodes; raises ValueError if one does (a corrupt trace).'''
+    size, labels, records = read_trace(path)
+    summary = {'failed': {}, 'backtracks': {}, 'wipeouts': {}, 'pruned': {}, 'probes': {},
+               'histogram': {}, 'folded': {}, 'nodes': 0, 'solutions': 0, 'restarts': 0}
+    failed = summary['failed']
+    stack = []
+    onPath = dict()
+    level = 0
+    branching = dict()
+
+    def pop(depth):
+        #close the assignments at depth or deeper, charging the nodes of
+        #their subtrees to their cell if no solution was found below
+        nonlocal level
+        while stack and stack[-1].depth >= depth:
+            frame = stack.pop()
+            level -= frame.decision
+            onPath[frame.cell] -= 1
+            if stack:
+                stack[-1].nodes += frame.nodes
+                stack[-1].solutions += frame.solutions
+            if frame.charge and not frame.solutions:
+                key = frame.cell + (frame.val,)
+                failed[key] = failed.get(key, 0) + frame.nodes
+
+    for (kind, depth, var, val, arg) in records:
+        if kind == NODE:
+            pop(depth)
+            summary['nodes'] += 1
+            summary['histogram'][level] = summary['histogram'].get(level, 0) + 1
+            if stack:
+                stack[-1].nodes += 1
+            branching[depth] = arg > 1
+        elif kind == ASSIGN:
+            pop(depth)
+            cell = cell_of(var, size)
+            stack.append(Frame(depth, var, val, cell, int(branching.get(depth, False)), not onPath.get(cell)))
+            onPath[cell] = onPath.get(cell, 0) + 1
+            level += stack[-1].decision
+        elif kind == PROPAGATE:
+            label = labels[arg]
+            summary['pruned'][label] = summary['pruned'].get(label, 0) + depth
+        elif kind == WIPEOUT:
+            label = labels[arg]
+            summary['wipeouts'][label] = summary['wipeouts'].get(label, 0) + 1
+            frames = [f for f in stack if f.decision][:maxStack]
+            key = ";".join(["r{}c{}={}".format(*(cell_of(f.var, size) + ('ship' if f.val else 'water',)))
+                            for f in frames] + [label])
+            summary['folded'][key] = summary['folded'].get(key, 0) + 1
+        elif kind == BACKTRACK:
+            key = cell_of(var, size)
+            if not any(f.cell == key for f in stack if f.depth < depth):
+                summary['backtracks'][key] = summary['backtracks'].get(key, 0) + 1
+        elif kind == SOLUTION:
+            summary['solutions'] += 1
+            if stack:
+                stack[-1].solutions += 1
+        elif kind == RESTART:
+            pop(0)
+            summary['restarts'] += 1
+        elif kind == PROBE:
+            key = cell_of(var, size) + (val,)
+            summary['probes'][key] = summary['probes'].get(key, 0) + 1
+    pop(0)
+    for table in ('failed', 'backtracks'):
+        if any(total > summary['nodes'] for total in summary[table].values()):
+            raise ValueError("{}: a cell is charged more nodes than the trace has".format(path))
+    return summary
+
+
+def _top(table, count):
+    return sorted(table.items(), key=lambda item: -item[1])[:count]
+
+def print_summary(summary, top=10, out=sys.stdout):
+    '''print the replay summary: the cells and constraints behind the most
+       backtracking and the search tree size per decision depth'''
+    out.write("{} nodes, {} solutions, {} restarts\n".format(
+        summary['nodes'], summary['solutions'], summary['restarts']))
+    out.write("\nnodes under failed assignments, by cell:\n")
+    for ((i, j, val), nodes) in _top(summary['failed'], top):
+        out.write("{:>10}  r{}c{}={}\n".format(nodes, i, j, 'ship' if val else 'water'))
+    out.write("\nnodes out of values, by cell:\n")
+    for ((i, j), count) in _top(summary['backtracks'], top):
+        out.write("{:>10}  r{}c{}\n".format(count, i, j))
+    out.write("\nwipeouts, by constraint:\n")
+    for (label, count) in _top(summary['wipeouts'], top):
+        out.write("{:>10}  {}\n".format(count, label))
+    out.write("\nvalues pruned, by constraint:\n")
+    for (label, count) in _top(summary['pruned'], top):
+        out.write("{:>10}  {}\n".format(count, label))
+    if summary['probes']:
+        out.write("\nfailed probes, by cell:\n")
+        for ((i, j, val), count) in _top(summary['probes'], top):
+            out.write("{:>10}  r{}c{}={}\n".format(count, i, j, 'ship' if val else 'water'))
+    out.write("\nnodes per decision depth:\n")
+    histogram = summary['histogram']
+    widest = max(histogram.values() or [1])
+    for depth in sorted(histogram):
+        out.write("{:>5} {:>10}  {}\n".format(depth, histogram[depth], '#' * max(1, 50 * histogram[depth] // widest)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise a search trace written by battle.py --trace.")
+    parser.add_argument(
+        "tracefile",
+        type=str,
+        help="The trace file."
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of cells and constraints to list."
+    )
+    parser.add_argument(
+        "--folded",
+        action="store_true",
+        help="Print the wipeouts as folded stacks (for flamegraph.pl) instead."
+    )
+    parser.add_argument(
+        "--maxstack",
+        type=int,
+        default=None,
+        help="Keep only the first decisions of each folded stack."
+    )
+    args = parser.parse_args()
+    try:
+        summary = replay(args.tracefile, args.maxstack)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.folded:
+        for (stack, count) in sorted(summary['folded'].items()):
+            print("{} {}".format(stack, count))
+    else:
+        print_summary(summary, args.top)
+
+#   python3 battle.py --inputfile largetest.txt --outputfile out.txt --nodecompose --trace largetest.trace
+#   python3 searchtrace.py largetest.trace
+#   python3 searchtrace.py largetest.trace --folded --maxstack 12 | flamegraph.pl > largetest.svg
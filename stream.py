@@ -0,0 +1,81 @@
+import sys
+import json
+import time
+import collections
+import multiprocessing
+from model import parse_puzzle, solve_puzzle
+
+
+def read_puzzles(file):
+    '''yield the puzzles of a blank line separated stream of puzzles in
+       the input file format, one text at a time (the stream is never
+       read as a whole)'''
+    lines = []
+    for line in file:
+        line = line.strip()
+        if line:
+            lines.append(line)
+        elif lines:
+            yield "\n".join(lines)
+            lines = []
+    if lines:
+        yield "\n".join(lines)
+
+
+def solve_text(text, options=None):
+    '''Solve the puzzle in text with solve_puzzle. options are keyword
+       arguments for BattleshipModel.solve. Returns (solution, metadata):
+       the solution board as text ('no solution' if none was found) and a
+       dict with the status, time and nodes.'''
+    t_start = time.time()
+    try:
+        puzzle = parse_puzzle(text)
+    except ValueError as e:
+        return "no solution", {"status": "error", "error": str(e), "time": time.time() - t_start, "nodes": 0}
+    result = solve_puzzle(puzzle, **(options or {}))
+    meta = {"status": result.status, "time": time.time() - t_start, "nodes": result.nodes}
+    return result.solution() or "no solution", meta
+
+
+def _solve_task(task):
+    return solve_text(*task)
+
+
+def solve_stream(infile, outfile, workers=1, inflight=None, metadata=False, options=None, separator=""):
+    '''Solve the puzzles of infile (see read_puzzles) and write their
+       solutions to outfile in input order, each followed by a JSON line
+       of metadata if metadata is set and by the separator line.
+
+       The puzzles are solved by a pool of workers processes with at most
+       inflight puzzles (default 2 per worker) read ahead of the last
+       solution written, so memory stays bounded however long the
+       stream is.'''
+    def write(index, solution, meta):
+        outfile.write(solution + "\n")
+        if metadata:
+            meta["index"] = index
+            outfile.write(json.dumps(meta) + "\n")
+        outfile.write(separator + "\n")
+        outfile.flush()
+
+    if workers <= 1:
+        for index, text in enumerate(read_puzzles(infile)):
+            write(index, *solve_text(text, options))
+        return
+
+    if inflight is None:
+        inflight = 2 * workers
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for index, text in enumerate(read_puzzles(infile)):
+            if len(pending) >= inflight:
+                done, result = pending.popleft()
+                write(done, *result.get())
+            pending.append((index, pool.apply_async(_solve_task, ((text, options),))))
+        while pending:
+            done, result = pending.popleft()
+            write(done, *result.get())
+    finally:
+        pool.close()
+        pool.join()
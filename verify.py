@@ -0,0 +1,164 @@
+import sys
+import argparse
+import multiprocessing
+from constraints import parse_counts
+
+_ship = {'S': 1, '<': 1, '>': 1, '^': 1, 'v': 1, 'M': 1, '.': 0}
+
+
+def verify_solution(puzzle_text, solution_text):
+    '''Check a solution board against a puzzle, both as text (the input
+       and output file formats), without building a CSP: the board is
+       read into a flat padded bytearray of 1 (ship) / 0 (water) and the
+       row/column sums, hints, ship shapes (straight, not touching, the
+       glyph of every cell matching its ship) and the fleet are checked
+       on it.
+
+       Only the first n lines of the solution are read, anything after
+       the board (e.g. a timing footer) is ignored. Returns the list of
+       the reasons the solution is wrong, empty if it is right.'''
+    tokens = puzzle_text.split()
+    try:
+        rows, cols, fleet = [parse_counts(t) for t in tokens[:3]]
+    except ValueError:
+        return ["malformed puzzle"]
+    n = len(rows)
+    board = tokens[3:]
+    if len(cols) != n or len(board) != n or any(len(row) != n for row in board):
+        return ["malformed puzzle"]
+
+    sol = solution_text.split()[:n]
+    if len(sol) != n or any(len(row) != n for row in sol):
+        return ["solution is not a {0}x{0} board".format(n)]
+    for row in sol:
+        for ch in row:
+            if ch not in _ship:
+                return ["unknown glyph {!r}".format(ch)]
+
+    size = n + 2
+    grid = bytearray(size * size)
+    for i in range(n):
+        for j in range(n):
+            grid[(i+1)*size+j+1] = _ship[sol[i][j]]
+
+    reasons = []
+    for i in range(n):
+        total = sum(grid[(i+1)*size+1:(i+1)*size+n+1])
+        if total != rows[i]:
+            reasons.append("row {} has {} ship cells, expected {}".format(i, total, rows[i]))
+    for j in range(n):
+        total = sum(grid[j+1+size:j+1+size*(n+1):size])
+        if total != cols[j]:
+            reasons.append("column {} has {} ship cells, expected {}".format(j, total, cols[j]))
+    for i in range(n):
+        for j in range(n):
+            if board[i][j] != '0' and board[i][j] != sol[i][j]:
+                reasons.append("hint {!r} at {},{} not kept".format(board[i][j], i, j))
+
+    ships = [0] * (n + 1)
+    for k in range(size + 1, size * (n + 1) - 1):
+        if not grid[k]:
+            continue
+        if grid[k-size-1] or grid[k-size+1] or grid[k+size-1] or grid[k+size+1]:
+            reasons.append("ships touch diagonally at {},{}".format(k // size - 1, k % size - 1))
+        horizontal = grid[k-1] or grid[k+1]
+        vertical = grid[k-size] or grid[k+size]
+        if horizontal and vertical:
+            reasons.append("ship bends at {},{}".format(k // size - 1, k % size - 1))
+        elif horizontal:
+            glyph = 'M' if grid[k-1] and grid[k+1] else ('<' if grid[k+1] else '>')
+        elif vertical:
+            glyph = 'M' if grid[k-size] and grid[k+size] else ('^' if grid[k+size] else 'v')
+        else:
+            glyph = 'S'
+        if not (horizontal and vertical) and sol[k // size - 1][k % size - 1] != glyph:
+            reasons.append("glyph at {},{} should be {!r}".format(k // size - 1, k % size - 1, glyph))
+        #count each ship at its top/left cell
+        if not grid[k-1] and not grid[k-size]:
+            step = 1 if grid[k+1] else size
+            L = 1
+            while grid[k+L*step]:
+                L += 1
+            ships[L] += 1
+    for L in range(1, n + 1):
+        expected = fleet[L-1] if L <= len(fleet) else 0
+        if ships[L] != expected:
+            reasons.append("{} ships of length {}, expected {}".format(ships[L], L, expected))
+    return reasons
+
+
+def verify_file(pair):
+    '''verify the solution file pair[1] of the puzzle file pair[0],
+       returns (pair, reasons)'''
+    try:
+        with open(pair[0]) as f:
+            puzzle = f.read()
+        with open(pair[1]) as f:
+            solution = f.read()
+    except OSError as e:
+        return pair, [str(e)]
+    return pair, verify_solution(puzzle, solution)
+
+
+def verify_files(pairs, workers=1, chunksize=64):
+    '''verify (puzzle file, solution file) pairs, in a process pool of
+       workers processes if workers > 1. Yields (pair, reasons) in the
+       order of pairs.'''
+    if workers <= 1:
+        for pair in pairs:
+            yield verify_file(pair)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap(verify_file, pairs, chunksize):
+            yield result
+
+
+def read_pairs(file):
+    '''the (puzzle, solution) file pairs listed in file, one pair per line'''
+    for line in file:
+        names = line.split()
+        if len(names) == 2:
+            yield (names[0], names[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify battleship solution files against their puzzles.")
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="Puzzle and solution files, alternating."
+    )
+    parser.add_argument(
+        "--pairs",
+        type=str,
+        default=None,
+        help="File listing a puzzle file and its solution file per line ('-' for stdin)."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes."
+    )
+    args = parser.parse_args()
+    if len(args.files) % 2:
+        parser.error("files must come in puzzle/solution pairs")
+    pairs = list(zip(args.files[0::2], args.files[1::2]))
+    if args.pairs == '-':
+        pairs += list(read_pairs(sys.stdin))
+    elif args.pairs is not None:
+        with open(args.pairs) as f:
+            pairs += list(read_pairs(f))
+
+    failed = 0
+    for (pair, reasons) in verify_files(pairs, args.workers):
+        if reasons:
+            failed += 1
+            print("FAIL {}: {}".format(pair[1], "; ".join(reasons)))
+        else:
+            print("PASS {}".format(pair[1]))
+    print("{} passed, {} failed".format(len(pairs) - failed, failed), file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+#   python3 verify.py input_hard1.txt output_hard1.txt
+#   ls archive/*_sol.txt | sed 's/\(.*\)_sol.txt/\1.txt &/' | python3 verify.py --pairs - --workers 8